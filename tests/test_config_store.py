@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ver7  # noqa: E402
+
+
+def test_reload_keeps_unflushed_keys_in_place(tmp_path):
+    path = str(tmp_path / "config.csv")
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("COM Port,COM3\nModel,DJ9600267A\nVendor,EBA3\n")
+    store = ver7.ConfigStore(path, delay=60)
+    store.load()
+    store.set("Model", "DJ9600268A")
+
+    assert store.reload() is False  # file không đổi -> không báo thay đổi
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("COM Port,COM4\nModel,DJ9600267A\nVendor,EBA3\n")
+    assert store.reload() is True
+    assert store._rows == [["COM Port", "COM4"], ["Model", "DJ9600268A"], ["Vendor", "EBA3"]]
+
+    store.close()
+    with open(path, encoding="utf-8") as f:
+        assert f.read().splitlines() == ["COM Port,COM4", "Model,DJ9600268A", "Vendor,EBA3"]
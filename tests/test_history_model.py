@@ -0,0 +1,63 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ver7  # noqa: E402
+
+
+def _result(serial_no, second):
+    return ver7.ResultEvent(
+        status="OK", adc="0,0,0,0,0", sensors=("0",) * 5, ok_count=1, ng_count=0,
+        total_count=1, serial_no=serial_no, model="DJ9600267A", vendor="EBA3",
+        timestamp=datetime(2026, 10, 18, 8, 0, second), line="OK:data=0,0,0,0,0",
+    )
+
+
+def test_appended_row_uses_persisted_no(tmp_path):
+    # File sửa tay: đã xoá bớt dòng đầu -> No. không còn bằng số dòng
+    writer = ver7.DailyCsvWriter(str(tmp_path))
+    for i in range(5):
+        writer.write(_result(f"SN{i}", i))
+    writer.close()
+    path = writer.path_for("2026-10-18")
+    with open(path, encoding="utf-8", newline="") as f:
+        lines = f.readlines()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.writelines(lines[:1] + lines[3:])
+
+    model = ver7.ResultTableModel()
+    model.set_source(ver7.CsvHistorySource(path), "2026-10-18")
+    event = _result("SN5", 5)
+    model.append(ver7.history_row(event, model.next_no()))
+
+    writer = ver7.DailyCsvWriter(str(tmp_path))
+    writer.write(event)
+    writer.close()
+    assert model.row(model.rowCount() - 1)[0] == str(writer.row_no) == "6"
+
+
+def test_csv_index_reads_only_appended_rows(tmp_path):
+    writer = ver7.DailyCsvWriter(str(tmp_path))
+    for i in range(3):
+        writer.write(_result(f"SN{i}", i))
+    source = ver7.CsvHistorySource(writer.path_for("2026-10-18"))
+    assert source.count() == 3
+    indexed = source._indexed
+
+    writer.write(_result("SN3", 3))
+    writer._file.write('5,2026-10-18,08:00:04,"0,0')   # dòng đang ghi dở -> chưa tính
+    writer._file.flush()
+    assert source.count() == 4
+    assert source._indexed > indexed
+    assert [row[4] for row in source.fetch(0, 10)] == ["SN0", "SN1", "SN2", "SN3"]
+
+    writer._file.write(',0,0,0",OK,SN4\r\n')
+    writer.close()
+    assert source.count() == 5 and source.fetch(4, 1)[0][4] == "SN4"
+
+    # File bị ghi lại (os.replace) -> lập chỉ mục lại từ đầu
+    path = writer.path_for("2026-10-18")
+    ver7.atomic_write_rows(path, [ver7.RESULT_HEADER, ["1", "2026-10-18", "09:00:00", "0", "NG", "SN9"]])
+    assert source.count() == 1 and source.fetch(0, 1)[0][4] == "SN9"
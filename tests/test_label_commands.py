@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ver7  # noqa: E402
+
+
+def _backend(language):
+    return ver7.LabelCommandBackend(language, ver7.FileSink(os.devnull))
+
+
+def test_zpl_escapes_command_characters():
+    cmd = _backend("zpl").build("18DJ9600267AEBA3YAP0001", 'DJ^96~00"_A').decode()
+    assert "^FH^FDDJ_5E96_7E00\"_5FA^FS" in cmd
+    assert cmd.count("^XA") == cmd.count("^XZ") == 1
+
+
+def test_tspl_escapes_quotes():
+    cmd = _backend("tspl").build("18DJ9600267AEBA3YAP0001", 'DJ"96').decode()
+    assert 'TEXT 160,264,"3",0,1,1,2,"DJ\\["]96"\r\n' in cmd
+
+
+def test_caption_below_actual_qr_size():
+    backend = _backend("zpl")
+    short = backend.build("18DJ9600267AEBA3YAP0001", "M").decode()
+    long = backend.build("18" + "X" * 60, "M").decode()
+    caption_y = [int(c.split("^FO0,")[1].split("^")[0]) for c in (short, long)]
+    assert caption_y[1] > caption_y[0]
@@ -0,0 +1,19 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ver7  # noqa: E402
+
+
+def test_only_cr_lf_break_lines():
+    framer = ver7.LineFramer()
+    assert framer.feed(b"OK\x0c") == []
+    assert framer.feed(b"NG\n") == ["OK\x0cNG"]
+
+
+def test_crlf_split_across_chunks():
+    framer = ver7.LineFramer()
+    assert framer.feed(b"A1=1\r") == ["A1=1"]
+    assert framer.feed(b"\nA2=2\rSTA") == ["A2=2"]
+    assert framer.feed(b"RT\r\n") == ["START"]
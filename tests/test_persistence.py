@@ -0,0 +1,52 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ver7  # noqa: E402
+
+
+def _result(serial_no, ok_count):
+    return ver7.ResultEvent(
+        status="OK", adc="0,0,0,0,0", sensors=("0",) * 5, ok_count=ok_count, ng_count=0,
+        total_count=ok_count, serial_no=serial_no, model="DJ9600267A", vendor="EBA3",
+        timestamp=datetime(2026, 10, 18, 8, 0, ok_count), line="OK:data=0,0,0,0,0",
+    )
+
+
+def test_failed_result_survives_restart(tmp_path):
+    path = str(tmp_path / ver7.JOURNAL_FILE)
+    saved = []
+
+    def save(result):
+        if result.serial_no == "SN2":
+            raise OSError("disk full")
+        saved.append(result.serial_no)
+
+    journal = ver7.ResultJournal(path)
+    worker = ver7.PersistenceWorker(save, journal, flush=lambda: True, idle_interval=0.01)
+    worker.start()
+    for i in (1, 2, 3):
+        worker.submit(_result(f"SN{i}", i))
+    worker.stop()
+    journal.close()
+
+    assert saved == ["SN1", "SN3"]
+    assert os.path.getsize(path) > 0
+    recovered = ver7.ResultJournal(path).pending()
+    assert [r.serial_no for r in recovered] == ["SN2"]
+
+
+def test_journal_truncated_when_everything_saved(tmp_path):
+    path = str(tmp_path / ver7.JOURNAL_FILE)
+    journal = ver7.ResultJournal(path)
+    worker = ver7.PersistenceWorker(lambda r: None, journal, flush=lambda: True, idle_interval=0.01)
+    worker.start()
+    for i in (1, 2, 3):
+        worker.submit(_result(f"SN{i}", i))
+    worker.stop()
+    journal.close()
+
+    assert os.path.getsize(path) == 0
+    assert ver7.ResultJournal(path).pending() == []
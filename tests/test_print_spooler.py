@@ -0,0 +1,40 @@
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtGui import QGuiApplication  # noqa: E402
+
+import ver7  # noqa: E402
+
+app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+
+
+class RecordingBackend:
+    name = "test"
+    needs_image = True
+
+    def __init__(self):
+        self.images = []
+
+    def send(self, job):
+        self.images.append(job.image.copy())
+
+
+def test_finished_jobs_drop_image_and_reprint_redraws():
+    backend = RecordingBackend()
+    renderer = ver7.LabelRenderer()
+    spooler = ver7.PrintSpooler(backend, renderer=renderer)
+    spooler.start()
+    serial_no = "18DJ9600267AEBA3YAP0001"
+    image = renderer.render_matrix(renderer.encode(serial_no), "DJ9600267A", "EBA3")
+    job = spooler.submit(image, serial_no, "DJ9600267A", "EBA3")
+    del image
+    again = spooler.reprint(serial_no)
+    assert spooler.stop()
+
+    assert job.image is None and again.image is None
+    assert job.status == again.status == ver7.JOB_SENT
+    assert len(backend.images) == 2 and backend.images[0] == backend.images[1]
+    assert spooler.reprint("18DJ9600267AEBA3YAP9999") is None
@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ver7  # noqa: E402
+
+
+def test_pinned_version_matches_full_search():
+    encoder = ver7.QrEncoder()
+    encoder.calibrate("18DJ9600267AEBA3YAP0001")
+    for counter in (2, 39, 1234, 9999):
+        serial_no = f"18DJ9600267AEBA3YAP{counter:04d}"
+        assert encoder.encode(serial_no).get_matrix() == ver7.encode_qr(serial_no).get_matrix()
+    assert encoder.calibrations == 1
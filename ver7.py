@@ -2,20 +2,45 @@ import os
 import sys
 import csv
 import re
+import time
+import codecs
+import argparse
+import glob
+import sqlite3
+import threading
+import queue
+import socket
+import bisect
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from collections import OrderedDict, deque, Counter
 import serial
 import serial.tools.list_ports
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QPushButton, QComboBox, QLineEdit,
-    QDesktopWidget, QMessageBox, QTableWidgetItem
+    QDesktopWidget, QMessageBox, QTableWidgetItem, QInputDialog, QPlainTextEdit, QWidget, QLabel,
+    QTableView, QHeaderView
 )
 from PyQt5.uic import loadUi
-from PyQt5.QtGui import QPixmap, QImage, QPainter, QColor, QFont, QIcon, QTextCursor
-from PyQt5.QtCore import QTimer, QDateTime, Qt, pyqtSignal
+from PyQt5.QtGui import (
+    QPixmap, QImage, QPainter, QColor, QFont, QIcon, QTextCursor, QGuiApplication, QPageSize, QBrush
+)
+from PyQt5.QtCore import (
+    QTimer, QDateTime, Qt, pyqtSignal, QThread, QFileSystemWatcher, QSizeF, QRect,
+    QAbstractTableModel, QAbstractProxyModel, QModelIndex
+)
 from PyQt5.QtPrintSupport import QPrinter
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import qrcode
+import qrcode.exceptions
 from PIL import Image
 
+try:
+    import numpy as np  # tuỳ chọn: đường vẽ QR nhanh (không qua PIL)
+except ImportError:
+    np = None
+
 # -------------------------
 # PyInstaller helpers
 # -------------------------
@@ -52,9 +77,2772 @@ COLOR_OK = "color: green; background-color: lightblue;"
 COLOR_NG = "color: red; background-color: lightblue;"
 COLOR_WAIT = "color: orange; background-color: lightyellow;"
 
+# =================== LABEL RENDERER ===================
+# ==== Tham số bố cục có thể chỉnh nhanh ====
+LABEL_QR_SIDE     = 300      # Kích thước QR vuông (px) — có thể đổi 236/280/320...
+LABEL_PADDING     = 12       # Lề xung quanh
+LABEL_TEXT_AREA_H = 72       # Vùng dành cho chữ (2 dòng)
+LABEL_CANVAS_W    = LABEL_QR_SIDE + 2 * LABEL_PADDING
+LABEL_CANVAS_H    = LABEL_QR_SIDE + 2 * LABEL_PADDING + LABEL_TEXT_AREA_H
+LABEL_FONT        = "SamsungSharpSans-Bold"
+LABEL_FONT_MAIN_SZ = 20      # size chữ dòng 1 (model)
+LABEL_FONT_SUB_SZ  = 14      # size chữ dòng 2 (qr_data)
+
+
+QR_BORDER = 2
+QR_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_M
+_QR_ALNUM = frozenset("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:")
+
+
+def encode_qr(qr_data: str) -> qrcode.QRCode:
+    """Mã hoá đầy đủ: tìm version nhỏ nhất (fit=True) và thử cả 8 mask."""
+    qr = qrcode.QRCode(version=1, error_correction=QR_ERROR_CORRECTION, box_size=12, border=QR_BORDER)
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+    return qr
+
+
+class QrEncoder:
+    """
+    Mã hoá QR với version / mức sửa lỗi cố định cho từng "hình dạng" payload.
+
+    S/N luôn cùng độ dài và cùng loại ký tự ở từng vị trí ("18" + model + vendor + Y/M/D
+    + 4 số), nên cùng cách chia segment và cùng số bit. Lần đầu gặp 1 hình dạng, calibrate()
+    tìm version nhỏ nhất (best_fit) và ghi nhớ; các label sau bỏ qua bước tìm version. Mask
+    KHÔNG được ghim: mask tốt phụ thuộc từng payload (mask của S/N khác có thể cho symbol
+    khó đọc), nên mỗi lần vẫn chấm điểm 8 mask. Payload không vừa version -> calibrate lại.
+    """
+
+    def __init__(self, error_correction=QR_ERROR_CORRECTION, border: int = QR_BORDER):
+        self.error_correction = error_correction
+        self.border = border
+        self.profiles = {}      # shape -> version
+        self.calibrations = 0
+
+    @staticmethod
+    def payload_shape(qr_data: str) -> str:
+        return "".join("N" if c.isdigit() else "A" if c in _QR_ALNUM else "B" for c in qr_data)
+
+    def _new(self, qr_data: str, version=None) -> qrcode.QRCode:
+        qr = qrcode.QRCode(version=version, error_correction=self.error_correction,
+                           box_size=12, border=self.border)
+        qr.add_data(qr_data)
+        return qr
+
+    def calibrate(self, qr_data: str) -> qrcode.QRCode:
+        qr = self._new(qr_data)
+        qr.make(fit=True)
+        self.profiles[self.payload_shape(qr_data)] = qr.version
+        self.calibrations += 1
+        return qr
+
+    def encode(self, qr_data: str) -> qrcode.QRCode:
+        version = self.profiles.get(self.payload_shape(qr_data))
+        if version is None:
+            return self.calibrate(qr_data)
+        qr = self._new(qr_data, version)
+        try:
+            qr.make(fit=False)
+        except qrcode.exceptions.DataOverflowError:
+            return self.calibrate(qr_data)
+        return qr
+
+    def version_for(self, qr_data: str) -> int:
+        """Version QR của qr_data (không dựng ma trận nếu hình dạng payload đã biết)."""
+        version = self.profiles.get(self.payload_shape(qr_data))
+        return version if version is not None else self.calibrate(qr_data).version
+
+
+def make_qr_qimage(qr_data: str, side: int = LABEL_QR_SIDE, qr: qrcode.QRCode = None) -> QImage:
+    """Tạo ảnh QR (PIL) kích thước side x side rồi chuyển sang QImage."""
+    qr = qr or encode_qr(qr_data)
+    qr_pil_image = qr.make_image(fill_color="black", back_color="white")
+    qr_pil_image = qr_pil_image.resize((side, side), resample=Image.NEAREST)  # Giữ cạnh sắc nét cho QR
+    # Chuyển PIL -> QImage nhanh (không cần PIL.ImageQt)
+    return pil_to_qimage(qr_pil_image)
+
+
+def qr_matrix_pixels(matrix, side: int = LABEL_QR_SIDE):
+    """
+    Phóng ma trận module QR (bool, đã gồm viền) lên side x side pixel bằng np.repeat
+    (tương đương resize NEAREST). Trả về mảng uint8 0/255, mỗi dòng căn 4 byte cho QImage.
+    """
+    modules = np.asarray(matrix, dtype=bool)
+    n = modules.shape[0]
+    # pixel x lấy module floor((x + 0.5) * n / side) — giống hệt resize NEAREST của PIL
+    counts = np.bincount(((2 * np.arange(side) + 1) * n) // (2 * side), minlength=n)
+    gray = np.where(modules, 0, 255).astype(np.uint8)
+    gray = np.repeat(np.repeat(gray, counts, axis=0), counts, axis=1)
+    stride = (side + 3) & ~3
+    if stride != side:
+        gray = np.pad(gray, ((0, 0), (0, stride - side)), constant_values=255)
+    return np.ascontiguousarray(gray)
+
+
+def wrap_gray_qimage(pixels, width: int) -> QImage:
+    """Bọc mảng uint8 thành QImage Grayscale8 không copy — giữ `pixels` sống khi còn dùng ảnh."""
+    h, stride = pixels.shape
+    return QImage(pixels.data, width, h, stride, QImage.Format_Grayscale8)
+
+
+class LabelRenderer:
+    """
+    Vẽ label (QR + tên model bên dưới) lên QImage.
+
+    Phần tĩnh (nền trắng + chữ model) được vẽ sẵn 1 lần cho mỗi cặp model/vendor và cache
+    lại; mỗi label chỉ copy template rồi đóng ảnh QR mới lên. Dùng QImage (không phải
+    QPixmap) nên có thể vẽ ngoài GUI thread.
+    """
+
+    MAX_TEMPLATES = 32
+
+    def __init__(self):
+        self._templates = {}
+        self._previews = {}     # (model, vendor, w, h) -> template đã thu nhỏ cho preview
+        self._lock = threading.Lock()
+        self.encoder = QrEncoder()
+
+    def template(self, model: str, vendor: str = "") -> QImage:
+        key = (model, vendor)
+        with self._lock:
+            tpl = self._templates.get(key)
+            if tpl is None:
+                if len(self._templates) >= self.MAX_TEMPLATES:
+                    self._templates.clear()
+                tpl = self._templates[key] = self._draw_template(model)
+            return tpl
+
+    @staticmethod
+    def _draw_template(model: str) -> QImage:
+        canvas = QImage(LABEL_CANVAS_W, LABEL_CANVAS_H, QImage.Format_RGB32)
+        canvas.fill(Qt.white)
+        painter = QPainter(canvas)
+
+        # Vẽ dòng chữ bên dưới vùng QR
+        painter.setPen(Qt.black)
+
+        # Dòng 1: model
+        font1 = QFont(LABEL_FONT, LABEL_FONT_MAIN_SZ)
+        painter.setFont(font1)
+        fm1 = painter.fontMetrics()
+        text1 = fm1.elidedText(model, Qt.ElideRight, LABEL_CANVAS_W - 2 * LABEL_PADDING)
+        text1_w = fm1.horizontalAdvance(text1)
+        text1_x = (LABEL_CANVAS_W - text1_w) // 2
+        text1_baseline_y = LABEL_PADDING + LABEL_QR_SIDE + LABEL_PADDING + fm1.ascent()
+        painter.drawText(text1_x, text1_baseline_y, text1)
+
+        # # Dòng 2: qr_data (nhỏ hơn, nằm dưới dòng 1) — thay đổi theo từng label nên
+        # # nếu bật lại thì phải vẽ trong render(), không đưa vào template.
+
+        painter.end()
+        return canvas
+
+    def encode(self, qr_data: str) -> list:
+        """Ma trận module QR (bool, gồm viền) của qr_data."""
+        return self.encoder.encode(qr_data).get_matrix()
+
+    def render_matrix(self, matrix, model: str, vendor: str = "") -> QImage:
+        """Vẽ label từ ma trận module QR đã mã hoá sẵn (vd. từ process con khi in hàng loạt)."""
+        label = self.template(model, vendor).copy()
+        self._stamp_qr(label, matrix, LABEL_QR_SIDE, LABEL_PADDING)
+        return label
+
+    def preview_template(self, model: str, vendor: str, width: int, height: int) -> QImage:
+        """Template đã thu nhỏ (smooth) vừa khung width x height — scale 1 lần rồi cache."""
+        key = (model, vendor, width, height)
+        with self._lock:
+            tpl = self._previews.get(key)
+        if tpl is None:
+            tpl = self.template(model, vendor).scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            with self._lock:
+                if len(self._previews) >= self.MAX_TEMPLATES:
+                    self._previews.clear()
+                self._previews[key] = tpl
+        return tpl
+
+    def render_preview(self, matrix, model: str, vendor: str, width: int, height: int) -> QImage:
+        """
+        Label cỡ màn hình vẽ thẳng từ ma trận QR (không vẽ label cỡ in rồi scale): copy template
+        đã thu nhỏ và đóng QR được phóng NEAREST đúng kích thước — cạnh module vẫn sắc nét.
+        """
+        preview = self.preview_template(model, vendor, width, height).copy()
+        f = preview.width() / LABEL_CANVAS_W
+        self._stamp_qr(preview, matrix, max(int(LABEL_QR_SIDE * f), len(matrix)), int(round(LABEL_PADDING * f)))
+        return preview
+
+    @staticmethod
+    def _stamp_qr(canvas: QImage, matrix, side: int, top: int):
+        """Phóng ma trận QR lên side x side pixel rồi vẽ vào canvas (căn giữa ngang, cách trên `top`)."""
+        if np is None:
+            n = len(matrix)
+            img = Image.new("L", (n, n))
+            img.putdata([0 if m else 255 for row in matrix for m in row])
+            qr_image = pil_to_qimage(img.resize((side, side), resample=Image.NEAREST))
+        else:
+            pixels = qr_matrix_pixels(matrix, side)   # phải sống tới khi vẽ xong
+            qr_image = wrap_gray_qimage(pixels, side)
+        painter = QPainter(canvas)
+        painter.drawImage((canvas.width() - side) // 2, top, qr_image)
+        painter.end()
+
+    def render(self, qr_image: QImage, model: str, vendor: str = "") -> QImage:
+        """Copy template của model/vendor và đóng ảnh QR (căn giữa theo chiều ngang) lên."""
+        label = self.template(model, vendor).copy()
+        painter = QPainter(label)
+        painter.drawImage((LABEL_CANVAS_W - qr_image.width()) // 2, LABEL_PADDING, qr_image)
+        painter.end()
+        return label
+
+
+LABEL_PREFETCH_DEPTH = 3   # số label kế tiếp được vẽ trước
+
+
+class LabelPrefetcher:
+    """
+    Vẽ trước N label kế tiếp trên thread nền trong lúc fixture còn đang test.
+
+    S/N kế tiếp đoán được hoàn toàn (cùng prefix, mã ngày, ok_count + 1...), nên khi dòng
+    OK tới label thường đã sẵn sàng. Khoá cache là (S/N, model, vendor); đổi model/vendor/
+    ngày thì gọi invalidate() để bỏ các label đã vẽ. Mỗi mục là (ma trận QR, label cỡ in);
+    label cỡ in chỉ được vẽ khi prefetch(full=True) — tức là khi có in hoặc lưu ảnh.
+    """
+
+    def __init__(self, renderer: LabelRenderer, depth: int = LABEL_PREFETCH_DEPTH):
+        self.renderer = renderer
+        self.depth = depth
+        self.hits = 0
+        self.misses = 0
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="LabelPrefetch")
+        self._futures = OrderedDict()   # (S/N, model, vendor) -> Future[(matrix, QImage | None)]
+        self._lock = threading.Lock()
+
+    def prefetch(self, serial_nos, model: str, vendor: str, full: bool = True):
+        # Template (có font) vẽ trên thread gọi; thread nền chỉ đóng QR lên bản copy
+        self.renderer.template(model, vendor)
+        with self._lock:
+            for sn in serial_nos:
+                key = (sn, model, vendor)
+                if key not in self._futures:
+                    self._futures[key] = self._pool.submit(self._prepare, sn, model, vendor, full)
+            while len(self._futures) > 4 * self.depth:
+                _, fut = self._futures.popitem(last=False)
+                fut.cancel()
+
+    def _prepare(self, serial_no: str, model: str, vendor: str, full: bool):
+        matrix = self.renderer.encode(serial_no)
+        return matrix, (self.renderer.render_matrix(matrix, model, vendor) if full else None)
+
+    def take(self, serial_no: str, model: str, vendor: str):
+        """(ma trận, label | None) đã chuẩn bị (chờ nếu đang dở) hoặc None nếu chưa được đặt trước."""
+        with self._lock:
+            fut = self._futures.pop((serial_no, model, vendor), None)
+        if fut is None or fut.cancelled():
+            self.misses += 1
+            return None
+        try:
+            prepared = fut.result()
+        except Exception:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return prepared
+
+    def invalidate(self):
+        with self._lock:
+            for fut in self._futures.values():
+                fut.cancel()
+            self._futures.clear()
+
+    def shutdown(self):
+        self.invalidate()
+        self._pool.shutdown(wait=True)
+
+
+LABEL_ARCHIVE_MODES = ("off", "last", "per-sn")   # config.csv: "label archive,<mode>"
+LABEL_ARCHIVE_LAST = "qr_code.png"      # mode last: chỉ giữ label mới nhất cạnh .exe
+LABEL_ARCHIVE_DIR = "labels"            # mode per-sn: labels/<YYYY-MM-DD>/<S/N>.png
+LABEL_PNG_QUALITY = 89                  # PNG của Qt: quality 89 -> zlib mức 1 (nén nhanh)
+
+
+class LabelArchiver:
+    """
+    Lưu ảnh label ra PNG trên thread nền, không chặn GUI thread.
+
+    off: không lưu; last: ghi đè qr_code.png (atomic, chỉ ghi label mới nhất nếu nhiều label
+    đang chờ); per-sn: mỗi S/N 1 file trong labels/<ngày>/.
+    """
+
+    def __init__(self, base_dir: str, mode: str = "last"):
+        self.base_dir = base_dir
+        self.mode = mode
+        self.saved = 0
+        self.failed = 0
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="LabelArchive")
+        self._lock = threading.Lock()
+        self._last_seq = 0
+
+    def set_mode(self, mode: str):
+        self.mode = mode if mode in LABEL_ARCHIVE_MODES else "last"
+
+    def submit(self, image: QImage, serial_no: str, day: str):
+        if self.mode == "off" or image is None:
+            return None
+        if self.mode == "per-sn" and serial_no:
+            path = os.path.join(self.base_dir, LABEL_ARCHIVE_DIR, day, serial_no + ".png")
+            return self._pool.submit(self._save, image, path)
+        with self._lock:
+            self._last_seq += 1
+            seq = self._last_seq
+        return self._pool.submit(self._save_last, image, seq)
+
+    def _save_last(self, image: QImage, seq: int):
+        if seq != self._last_seq:
+            return  # đã có label mới hơn trong hàng đợi
+        self._save(image, os.path.join(self.base_dir, LABEL_ARCHIVE_LAST))
+
+    def _save(self, image: QImage, path: str):
+        tmp = path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if not image.save(tmp, "PNG", LABEL_PNG_QUALITY):
+                raise OSError(f"không ghi được {tmp}")
+            os.replace(tmp, path)
+            self.saved += 1
+        except OSError as e:
+            self.failed += 1
+            print("Error saving label image:", e)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def _render_label_uncached(qr_image: QImage, model: str) -> QImage:
+    """Cách vẽ cũ (canvas mới + font + elide cho mỗi label) — chỉ giữ lại để benchmark."""
+    label = LabelRenderer._draw_template(model)
+    painter = QPainter(label)
+    painter.drawImage((LABEL_CANVAS_W - qr_image.width()) // 2, LABEL_PADDING, qr_image)
+    painter.end()
+    return label
+
+
+def bench_label_render(n: int = 500):
+    """So sánh vẽ label: vẽ lại toàn bộ mỗi lần vs template cache."""
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+    qr_image = make_qr_qimage("18DJ9600267AEBA3YAP0001")
+    renderer = LabelRenderer()
+    renderer.template("DJ9600267A", "EBA3")  # cache sẵn như sau label đầu tiên
+
+    t0 = time.perf_counter()
+    for _ in range(n):
+        _render_label_uncached(qr_image, "DJ9600267A")
+    uncached = (time.perf_counter() - t0) / n
+
+    t0 = time.perf_counter()
+    for _ in range(n):
+        renderer.render(qr_image, "DJ9600267A", "EBA3")
+    cached = (time.perf_counter() - t0) / n
+
+    print(f"label render: full redraw {uncached * 1000:.3f} ms, template {cached * 1000:.3f} ms "
+          f"({uncached / cached:.1f}x)")
+    return app
+
+
+def bench_qr_image(n: int = 300):
+    """So sánh ma trận QR -> QImage: PIL (make_image + resize + pil_to_qimage) vs NumPy."""
+    if np is None:
+        print("numpy chưa được cài — chỉ có đường PIL")
+        return
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+    qr = encode_qr("18DJ9600267AEBA3YAP0001")
+
+    t0 = time.perf_counter()
+    for _ in range(n):
+        make_qr_qimage("", LABEL_QR_SIDE, qr)
+    pil = (time.perf_counter() - t0) / n
+
+    t0 = time.perf_counter()
+    for _ in range(n):
+        pixels = qr_matrix_pixels(qr.get_matrix(), LABEL_QR_SIDE)
+        wrap_gray_qimage(pixels, LABEL_QR_SIDE)
+    fast = (time.perf_counter() - t0) / n
+
+    t0 = time.perf_counter()
+    for _ in range(n):
+        encode_qr("18DJ9600267AEBA3YAP0001")
+    enc = (time.perf_counter() - t0) / n
+
+    encoder = QrEncoder()
+    encoder.calibrate("18DJ9600267AEBA3YAP0001")
+    t0 = time.perf_counter()
+    for i in range(n):
+        encoder.encode(f"18DJ9600267AEBA3YAP{i % 10000:04d}")
+    pinned = (time.perf_counter() - t0) / n
+
+    print(f"QR -> QImage: PIL {pil * 1000:.3f} ms, NumPy {fast * 1000:.3f} ms ({pil / fast:.1f}x)")
+    print(f"encode: full search (fit=True, 8 masks) {enc * 1000:.3f} ms, "
+          f"pinned version {pinned * 1000:.3f} ms ({enc / pinned:.1f}x)")
+    return app
+
+
+# =================== PRINT SPOOLER ===================
+PRINT_MAX_ATTEMPTS = 3
+PRINT_RETRY_DELAY = 2.0      # s giữa 2 lần thử
+PRINT_HISTORY = 1000         # số job gần nhất giữ lại để in lại theo S/N
+
+JOB_QUEUED = "queued"
+JOB_SENT = "sent"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class PrintJob:
+    id: int
+    serial_no: str
+    image: QImage               # None với backend lệnh (ZPL/TSPL); bỏ đi khi job xong
+    model: str = ""
+    vendor: str = ""
+    status: str = JOB_QUEUED
+    attempts: int = 0
+    error: str = ""
+    created: float = field(default_factory=time.time)
+    latency: float = 0.0        # s — thời gian gửi job ở lần thử cuối (backend.send)
+    finished: float = 0.0       # time.time() khi job sent/failed
+
+
+@dataclass
+class PrintRecord:
+    """Lịch sử in của 1 S/N — chỉ metadata, không giữ ảnh; reprint() vẽ lại label từ S/N."""
+    job_id: int
+    serial_no: str
+    model: str = ""
+    vendor: str = ""
+    status: str = JOB_QUEUED
+    created: float = field(default_factory=time.time)
+    finished: float = 0.0
+
+
+def paint_label(printer: QPrinter, image: QImage):
+    """Vẽ label lên printer, giữ tỉ lệ, vừa khít vùng in."""
+    painter = QPainter()
+    if not painter.begin(printer):
+        raise RuntimeError("Không mở được máy in")
+    try:
+        _fit_label(painter, printer, image)
+    finally:
+        painter.end()
+
+
+def _fit_label(painter: QPainter, printer: QPrinter, image: QImage):
+    # Tính theo kích thước vùng in (không dùng painter.viewport() — đã bị đổi ở trang trước)
+    size = image.size()
+    size.scale(printer.width(), printer.height(), Qt.KeepAspectRatio)
+    painter.setViewport(0, 0, size.width(), size.height())
+    painter.setWindow(image.rect())
+    painter.drawImage(0, 0, image)
+
+
+class QtPrintBackend:
+    """
+    In raster qua QPrinter (driver Windows) — cách in mặc định.
+
+    QPrinter (kết nối driver, đọc cấu hình máy in) được tạo 1 lần rồi dùng lại cho các job
+    sau; job lỗi hoặc máy in báo Error (offline, hết giấy...) thì bỏ session, lần thử kế tiếp
+    mở lại từ đầu.
+    """
+    name = "qt"
+    needs_image = True
+
+    def __init__(self):
+        self._printer = None
+        self.sessions = 0       # số lần đã mở session (1 + số lần reset)
+
+    def open(self) -> QPrinter:
+        if self._printer is None:
+            self._printer = QPrinter(QPrinter.HighResolution)
+            self.sessions += 1
+        return self._printer
+
+    def reset(self):
+        self._printer = None
+
+    def send(self, job: PrintJob):
+        printer = self.open()
+        try:
+            paint_label(printer, job.image)
+            if printer.printerState() == QPrinter.Error:
+                raise RuntimeError("Máy in báo lỗi (offline?)")
+        except Exception:
+            self.reset()
+            raise
+
+    def close(self):
+        self.reset()
+
+
+# ---- Backend lệnh máy in nhiệt (ZPL / TSPL) ----
+PRINTER_DPI = 203            # dot/inch của máy in nhiệt
+LABEL_MM_W = 40              # khổ label (mm)
+LABEL_MM_H = 50
+LABEL_GAP_MM = 2
+QR_CELL_DOTS = 8             # kích thước 1 module QR (dot)
+CAPTION_DOTS = 32            # chiều cao chữ model (dot)
+
+
+def _mm_to_dots(mm: float) -> int:
+    return int(round(mm * PRINTER_DPI / 25.4))
+
+
+def _zpl_text(text: str) -> str:
+    """Nội dung cho ^FH^FD...^FS: "^", "~" (ký tự lệnh) và "_" (ký tự hex của ^FH) -> _XX."""
+    text = " ".join(text.splitlines())
+    return text.replace("_", "_5F").replace("^", "_5E").replace("~", "_7E")
+
+
+def _tspl_text(text: str) -> str:
+    """Nội dung chuỗi "..." của TSPL: dấu nháy kép viết thành \\["], bỏ xuống dòng."""
+    return " ".join(text.splitlines()).replace('"', '\\["]')
+
+
+class FileSink:
+    """Ghi lệnh vào file spool (append) — dùng để kiểm tra / cho phần mềm khác gửi đi."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, data: bytes):
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+class DeviceSink:
+    """Ghi thẳng vào thiết bị raw (vd. /dev/usb/lp0, \\\\PC\\SharedPrinter, COM5)."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, data: bytes):
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+class TcpSink:
+    """Gửi lệnh qua TCP (cổng RAW 9100 của máy in mạng)."""
+
+    def __init__(self, host: str, port: int = 9100, timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def send(self, data: bytes):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+            sock.sendall(data)
+
+    def close(self):
+        pass
+
+
+def open_sink(target: str):
+    """
+    "tcp://host:9100" -> TcpSink, "file:path" -> FileSink (append),
+    "dev:path" hoặc đường dẫn khác -> DeviceSink.
+    """
+    target = (target or "").strip()
+    if target.lower().startswith("tcp://"):
+        host, _, port = target[6:].rpartition(":")
+        if not host:
+            host, port = port, "9100"
+        return TcpSink(host, int(port or 9100))
+    if target.lower().startswith("file:"):
+        return FileSink(target[5:])
+    if target.lower().startswith("dev:"):
+        return DeviceSink(target[4:])
+    if not target:
+        raise ValueError("Chưa cấu hình 'printer target'")
+    return DeviceSink(target)
+
+
+class LabelCommandBackend:
+    """
+    Sinh lệnh ngôn ngữ máy in (ZPL hoặc TSPL) cho QR + tên model; máy in nhiệt tự vẽ QR,
+    mỗi job chỉ vài trăm byte thay vì ảnh raster nhiều MB.
+    """
+    needs_image = False
+
+    def __init__(self, language: str, sink):
+        self.name = language.lower()
+        if self.name not in ("zpl", "tspl"):
+            raise ValueError(f"Ngôn ngữ máy in không hỗ trợ: {language}")
+        self.sink = sink
+        self.encoder = QrEncoder()   # chỉ để biết version (số module) -> vị trí chữ dưới QR
+
+    def build(self, serial_no: str, model: str) -> bytes:
+        width = _mm_to_dots(LABEL_MM_W)
+        margin = _mm_to_dots(2)
+        # Máy in chọn version nhỏ nhất vừa dữ liệu (mức M) -> cùng số module như QrEncoder
+        modules = 17 + 4 * self.encoder.version_for(serial_no)
+        qr_dots = (modules + 2 * QR_BORDER) * QR_CELL_DOTS
+        qr_x = max((width - qr_dots) // 2, 0)
+        caption_y = margin + qr_dots + margin
+
+        if self.name == "zpl":
+            cmd = (
+                "^XA^CI28"
+                f"^PW{width}"
+                f"^FO{qr_x},{margin}^BQN,2,{QR_CELL_DOTS}^FH^FDMA,{_zpl_text(serial_no)}^FS"
+                f"^FO0,{caption_y}^A0N,{CAPTION_DOTS},{CAPTION_DOTS}^FB{width},1,0,C^FH^FD{_zpl_text(model)}^FS"
+                "^XZ\n"
+            )
+        else:
+            cmd = (
+                f"SIZE {LABEL_MM_W} mm,{LABEL_MM_H} mm\r\n"
+                f"GAP {LABEL_GAP_MM} mm,0 mm\r\n"
+                "CLS\r\n"
+                f'QRCODE {qr_x},{margin},M,{QR_CELL_DOTS},A,0,"{_tspl_text(serial_no)}"\r\n'
+                f'TEXT {width // 2},{caption_y},"3",0,1,1,2,"{_tspl_text(model)}"\r\n'
+                "PRINT 1,1\r\n"
+            )
+        return cmd.encode("utf-8")
+
+    def send(self, job: PrintJob):
+        self.sink.send(self.build(job.serial_no, job.model))
+
+    def close(self):
+        self.sink.close()
+
+
+def make_print_backend(kind: str, target: str = ""):
+    """Theo config "print backend" (qt | zpl | tspl) và "printer target"."""
+    kind = (kind or "qt").lower()
+    if kind == "qt":
+        return QtPrintBackend()
+    return LabelCommandBackend(kind, open_sink(target))
+
+
+class PrintSpooler(QThread):
+    """
+    In label trên thread riêng: hàng đợi job, trạng thái từng job (queued/sent/failed),
+    thử lại PRINT_MAX_ATTEMPTS lần, và in lại theo S/N từ các job gần nhất.
+    Driver máy in chậm không còn ảnh hưởng tới cycle time hay việc đọc COM. Ảnh label chỉ
+    sống tới khi job xong; lịch sử in giữ PrintRecord và reprint() vẽ lại qua LabelRenderer.
+    Việc gửi job do backend đảm nhận (QtPrintBackend / LabelCommandBackend); backend được
+    mở sẵn khi thread bắt đầu và đóng khi stop(). Thời gian gửi mỗi job nằm trong
+    PrintJob.latency và job_status, thống kê gần đây qua latency_stats().
+    """
+    job_status = pyqtSignal(int, str, str, str, float)   # job id, S/N, status, lỗi, latency (ms)
+
+    _STOP = object()
+
+    def __init__(self, backend=None, parent=None, renderer=None):
+        super().__init__(parent)
+        self.backend = backend or QtPrintBackend()
+        self.renderer = renderer or LabelRenderer()
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._history = OrderedDict()   # S/N -> PrintRecord của lần in gần nhất
+        self._timings = deque(maxlen=PRINT_HISTORY)   # (status, latency s, finished) của job đã xong
+
+    def submit(self, image: QImage, serial_no: str = "", model: str = "", vendor: str = "") -> PrintJob:
+        with self._lock:
+            self._next_id += 1
+            job = PrintJob(self._next_id, serial_no, image, model, vendor)
+            if serial_no:
+                self._history[serial_no] = PrintRecord(job.id, serial_no, model, vendor)
+                self._history.move_to_end(serial_no)
+                while len(self._history) > PRINT_HISTORY:
+                    self._history.popitem(last=False)
+        self._queue.put(job)
+        self.job_status.emit(job.id, serial_no, JOB_QUEUED, "", 0.0)
+        return job
+
+    def reprint(self, serial_no: str):
+        """In lại label của S/N (nếu còn trong lịch sử); trả về job mới hoặc None."""
+        with self._lock:
+            old = self._history.get(serial_no)
+        if old is None:
+            return None
+        image = None
+        if self.backend.needs_image:
+            # Label chỉ phụ thuộc S/N + model/vendor -> vẽ lại giống hệt lần in trước
+            image = self.renderer.render_matrix(self.renderer.encode(serial_no), old.model, old.vendor)
+        return self.submit(image, serial_no, old.model, old.vendor)
+
+    def stop(self, timeout_ms: int = 10000) -> bool:
+        """
+        Dừng ngay: không thử lại, các job còn trong hàng đợi được đánh dấu failed thay vì in
+        tiếp. Chỉ phải chờ lần gửi đang dở (tối đa timeout của sink). True nếu thread đã thoát.
+        """
+        self._stop_event.set()
+        self._queue.put(self._STOP)
+        return self.wait(timeout_ms)
+
+    def latency_stats(self) -> dict:
+        """Latency (ms) của PRINT_HISTORY job gần nhất đã gửi thành công: count/avg/max/last."""
+        with self._lock:
+            sent = [latency for status, latency, _ in self._timings if status == JOB_SENT]
+        if not sent:
+            return {"count": 0, "avg": 0.0, "max": 0.0, "last": 0.0}
+        return {"count": len(sent), "avg": sum(sent) / len(sent) * 1000,
+                "max": max(sent) * 1000, "last": sent[-1] * 1000}
+
+    def run(self):
+        open_backend = getattr(self.backend, "open", None)
+        if open_backend is not None:
+            try:
+                open_backend()  # mở session sẵn, job đầu không phải chờ driver
+            except Exception as e:
+                print("Error opening printer:", e)
+        try:
+            self._loop()
+        finally:
+            close_backend = getattr(self.backend, "close", None)
+            if close_backend is not None:
+                close_backend()
+
+    def _loop(self):
+        while True:
+            job = self._queue.get()
+            if job is self._STOP:
+                return
+            if self._stop_event.is_set():
+                self._finish(job, JOB_FAILED, "spooler stopped")
+                continue
+            while True:
+                job.attempts += 1
+                t0 = time.perf_counter()
+                try:
+                    self._print(job)
+                except Exception as e:
+                    job.latency = time.perf_counter() - t0
+                    job.error = str(e)
+                    # Chờ giữa 2 lần thử nhưng thoát ngay khi stop()
+                    if job.attempts < PRINT_MAX_ATTEMPTS and not self._stop_event.wait(PRINT_RETRY_DELAY):
+                        continue
+                    self._finish(job, JOB_FAILED, job.error)
+                else:
+                    job.latency = time.perf_counter() - t0
+                    self._finish(job, JOB_SENT, "")
+                break
+
+    def _finish(self, job: PrintJob, status: str, error: str):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        job.image = None   # canvas cỡ in ~500 KB — không giữ sau khi gửi xong
+        with self._lock:
+            self._timings.append((status, job.latency, job.finished))
+            record = self._history.get(job.serial_no)
+            if record is not None and record.job_id == job.id:
+                record.status, record.finished = status, job.finished
+        self.job_status.emit(job.id, job.serial_no, job.status, job.error, job.latency * 1000)
+
+    def _print(self, job: PrintJob):
+        self.backend.send(job)
+
+
+# =================== SERIAL CONSTANTS ===================
+SERIAL_BAUDRATE = 115200
+SERIAL_READ_TIMEOUT = 0.05  # s — read() block tối đa, để thread kịp thoát khi stop()
+SERIAL_MAX_LINE = 1024      # byte — dòng dài hơn (rác/nhiễu) sẽ bị bỏ
+SERIAL_RECONNECT_MIN_MS = 500     # ms — chờ trước lần mở lại COM đầu tiên sau lỗi
+SERIAL_RECONNECT_MAX_MS = 10000   # ms — trần backoff (nhân đôi sau mỗi lần lỗi liên tiếp)
+
+
+# =================== LINE FRAMER ===================
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+class LineFramer:
+    """
+    Tách dòng từ luồng byte COM, chấp nhận "\n", "\r\n" và "\r" đơn (firmware in "A1=...\r\n").
+
+    Mỗi chunk chỉ được decode 1 lần (incremental decoder, không vỡ ký tự UTF-8 giữa 2 chunk)
+    rồi tách bằng _LINE_BREAK.split() — không slice/del buffer cho từng dòng, nên một burst
+    nhiều KB được xử lý trong thời gian tuyến tính. Chỉ phần dòng dở dang cuối chunk được
+    giữ lại; dòng dài quá max_line bị bỏ và đếm vào `overflow`. Không dùng str.splitlines():
+    nó còn tách ở \x0b \x0c \x1c-\x1e \x85 \u2028 \u2029, lệch với phần kiểm tra đuôi chunk.
+    """
+
+    def __init__(self, max_line: int = SERIAL_MAX_LINE, encoding: str = "utf-8"):
+        self.max_line = max_line
+        self.overflow = 0
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="ignore")
+        self._pending = ""          # phần dòng chưa gặp ký tự xuống dòng
+        self._pending_cr = False    # chunk trước kết thúc bằng "\r" (có thể "\n" ở chunk sau)
+        self._discard = False       # đang bỏ phần còn lại của một dòng quá dài
+
+    def reset(self):
+        self._decoder.reset()
+        self._pending = ""
+        self._pending_cr = False
+        self._discard = False
+
+    def feed(self, data) -> list:
+        """Nhận 1 chunk (bytes/bytearray/memoryview), trả về list các dòng (str, đã strip, bỏ dòng rỗng)."""
+        text = self._decoder.decode(data)
+        if self._pending_cr and text.startswith("\n"):
+            text = text[1:]  # "\r" | "\n" bị cắt giữa 2 chunk
+        if not text:
+            return []
+        self._pending_cr = text.endswith("\r")
+
+        parts = _LINE_BREAK.split(text)
+        tail = parts.pop()  # "" nếu chunk kết thúc bằng xuống dòng
+
+        if self._pending or self._discard:
+            if parts:
+                # dòng đầu tiên của chunk là phần tiếp theo của dòng dở dang
+                if self._discard:
+                    parts[0] = ""
+                elif len(self._pending) + len(parts[0]) > self.max_line:
+                    parts[0] = ""
+                    self.overflow += 1
+                else:
+                    parts[0] = self._pending + parts[0]
+                self._pending = ""
+                self._discard = False
+            elif not self._discard:
+                tail = self._pending + tail
+
+        if self._discard:
+            tail = ""
+        elif len(tail) > self.max_line:
+            tail = ""
+            self._discard = True
+            self.overflow += 1
+        self._pending = tail
+
+        lines = []
+        for part in parts:
+            line = part.strip()
+            if not line:
+                continue
+            if len(line) > self.max_line:
+                self.overflow += 1
+                continue
+            lines.append(line)
+        return lines
+
+
+def _legacy_split_lines(buffer: bytearray, data) -> list:
+    """Cách tách dòng cũ (find + slice + del) — chỉ giữ lại để benchmark so sánh."""
+    lines = []
+    buffer.extend(data)
+    while True:
+        idx = buffer.find(b'\n')
+        if idx == -1:
+            break
+        line_bytes = buffer[:idx]
+        del buffer[: idx + 1]
+        line = line_bytes.decode('utf-8', errors='ignore').strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def bench_line_framer(burst_sizes_kb=(4, 16, 64, 256), chunk_size=None, repeat=5):
+    """Micro-benchmark: LineFramer vs cách tách dòng cũ trên các burst nhiều KB."""
+    sample = b"START\r\nA1=512 A2=498 A3=505 A4=511 A5=503\r\nOK:data=0,0,0,0,0\r\n"
+    print(f"-- chunk: {f'{chunk_size} B' if chunk_size else 'whole burst'}")
+    print(f"{'burst':>8} {'lines':>7} {'legacy ms':>10} {'framer ms':>10} {'speedup':>8}")
+    for kb in burst_sizes_kb:
+        burst = sample * max(1, (kb * 1024) // len(sample))
+        step = chunk_size or len(burst)
+        chunks = [burst[i:i + step] for i in range(0, len(burst), step)]
+
+        best_legacy = best_framer = float("inf")
+        for _ in range(repeat):
+            buf = bytearray()
+            t0 = time.perf_counter()
+            n_legacy = sum(len(_legacy_split_lines(buf, c)) for c in chunks)
+            best_legacy = min(best_legacy, time.perf_counter() - t0)
+
+            framer = LineFramer()
+            t0 = time.perf_counter()
+            n_framer = sum(len(framer.feed(c)) for c in chunks)
+            best_framer = min(best_framer, time.perf_counter() - t0)
+
+        assert n_legacy == n_framer, (n_legacy, n_framer)
+        print(f"{kb:>6}KB {n_framer:>7} {best_legacy * 1000:>10.3f} {best_framer * 1000:>10.3f} "
+              f"{best_legacy / best_framer:>7.1f}x")
+
+
+# =================== SERIAL READER ===================
+class SerialReader(QThread):
+    """
+    Đọc COM trong thread riêng (blocking read), tách dòng và gửi về GUI qua signal.
+    GUI bận in/lưu file thì dữ liệu vẫn được đọc vào buffer, không mất byte.
+    """
+    line_received = pyqtSignal(str)
+    error = pyqtSignal(str)
+
+    def __init__(self, serial_connection, parent=None):
+        super().__init__(parent)
+        self._serial = serial_connection
+        self._running = False
+        self._framer = LineFramer()
+
+    def start(self, *args, **kwargs):
+        self._running = True
+        super().start(*args, **kwargs)
+
+    def stop(self):
+        """Dừng thread đọc (chờ thread thoát hẳn trước khi đóng cổng)."""
+        self._running = False
+        cancel_read = getattr(self._serial, "cancel_read", None)
+        if cancel_read is not None:
+            try:
+                cancel_read()
+            except Exception:
+                pass
+        self.wait(int(SERIAL_READ_TIMEOUT * 1000) * 10)
+
+    def run(self):
+        ser = self._serial
+        while self._running:
+            try:
+                # Block tới khi có ít nhất 1 byte (hoặc hết timeout), rồi lấy hết phần đang chờ
+                data = ser.read(ser.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self._running:
+                    self.error.emit(str(e))
+                return
+            if not data:
+                continue
+
+            for line in self._framer.feed(data):
+                self.line_received.emit(line)
+
+
+# =================== DATE CODES ===================
+YEAR_CODES = {2025: "Y", 2026: "L", 2027: "P"}
+MONTH_CODES = {10: "A", 11: "B", 12: "C"}
+DAY_CODES = "123456789ABCDEFGHJKLMNPRSTVWXYZ"  # ngày 1..31
+
+
+def date_codes(d: date):
+    """Mã năm/tháng/ngày in trên S/N. Năm/tháng chưa có mã thì dùng số (như bản cũ)."""
+    return (
+        YEAR_CODES.get(d.year, str(d.year)),
+        MONTH_CODES.get(d.month, str(d.month)),
+        DAY_CODES[d.day - 1],
+    )
+
+
+DATE_CODE_YEARS = 5               # số năm (tính từ năm hiện tại) được tính sẵn mã
+DATE_ROLLOVER_MARGIN_MS = 200     # timer nửa đêm bắn trễ một chút để chắc chắn đã sang ngày
+
+
+class DateCodeCalendar:
+    """
+    Bảng mã năm/tháng/ngày tính sẵn cho DATE_CODE_YEARS năm; codes() chỉ là 1 lần tra dict.
+    Ngày nằm ngoài bảng thì tính trực tiếp bằng date_codes().
+    """
+
+    def __init__(self, start_year: int = None, years: int = DATE_CODE_YEARS):
+        start = date(start_year or date.today().year, 1, 1)
+        end = date(start.year + years, 1, 1)
+        self._codes = {}
+        d = start
+        while d < end:
+            self._codes[d.toordinal()] = date_codes(d)
+            d += timedelta(days=1)
+
+    def codes(self, d: date):
+        found = self._codes.get(d.toordinal())
+        return found if found is not None else date_codes(d)
+
+
+def ms_until_midnight(now: datetime = None) -> int:
+    """Số ms từ `now` tới 00:00 của ngày hôm sau."""
+    now = now or datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return max(int((midnight - now).total_seconds() * 1000), 0)
+
+
+DATE_CODE_CALENDAR = DateCodeCalendar()
+
+
+# =================== STATION ENGINE ===================
+@dataclass(frozen=True)
+class StateEvent:
+    """Dòng START / WAITING từ fixture."""
+    state: str          # "START" | "WAITING"
+    line: str
+
+
+@dataclass(frozen=True)
+class ResultEvent:
+    """Kết quả 1 lần test (OK/NG) kèm bộ đếm sau khi cập nhật."""
+    status: str         # "OK" | "NG"
+    adc: str            # payload sau data= / Data:
+    sensors: tuple      # giá trị từng sensor ("0"/"1")
+    ok_count: int
+    ng_count: int
+    total_count: int
+    serial_no: str      # S/N của label (OK); NG giữ S/N đang hiển thị như bản cũ
+    model: str
+    vendor: str
+    timestamp: datetime
+    line: str
+
+    @property
+    def is_ok(self) -> bool:
+        return self.status == "OK"
+
+
+@dataclass(frozen=True)
+class CounterResetEvent:
+    """Bộ đếm được reset do sang ngày mới."""
+    date: str
+    reason: str
+
+
+class StationEngine:
+    """
+    Logic trạm test không phụ thuộc Qt: nhận dòng thô từ COM, cập nhật bộ đếm,
+    sinh S/N và phát event có kiểu (StateEvent / ResultEvent / CounterResetEvent)
+    cho các subscriber (GUI, lưu file, ...).
+    """
+
+    def __init__(self, model: str = "", vendor: str = "", clock=datetime.now):
+        self.model = model
+        self.vendor = vendor
+        self.ok_count = 0
+        self.ng_count = 0
+        self.total_count = 0
+        self.counter_date = None
+        self.last_serial_no = ""
+        self.last_adc = ""
+        self._clock = clock
+        self._subscribers = []
+
+    # ---- subscribe ----
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+        return callback
+
+    def _emit(self, event):
+        for callback in list(self._subscribers):
+            callback(event)
+        return event
+
+    # ---- state ----
+    def set_model(self, model: str):
+        self.model = (model or "").strip()
+
+    def set_vendor(self, vendor: str):
+        self.vendor = (vendor or "").strip()
+
+    def set_counters(self, ok: int, ng: int, total: int = None, counter_date: str = None):
+        self.ok_count = ok
+        self.ng_count = ng
+        self.total_count = ok + ng if total is None else total
+        self.counter_date = counter_date or self._clock().strftime("%Y-%m-%d")
+
+    def serial_no_for(self, counter: int, when: datetime = None) -> str:
+        """S/N = "18" + model + vendor + mã năm (ký tự cuối) + tháng + ngày + counter 4 số."""
+        year, month, day = DATE_CODE_CALENDAR.codes(when or self._clock())
+        return "".join(["18", self.model, self.vendor, year[-1], month, day, f"{counter:04d}"])
+
+    def check_day(self, reason: str = "timer"):
+        """Sang ngày mới so với counter_date -> reset bộ đếm, phát CounterResetEvent."""
+        today = self._clock().strftime("%Y-%m-%d")
+        if self.counter_date == today:
+            return None
+        self.ok_count = self.ng_count = self.total_count = 0
+        self.counter_date = today
+        return self._emit(CounterResetEvent(today, reason))
+
+    # ---- parse ----
+    @staticmethod
+    def extract_adc_payload(line: str):
+        """Tìm phần sau data= / Data: (case-insensitive) và trả về chuỗi '0,1,0,1,0' hoặc None."""
+        low = line.lower()
+        for token in ("data=", "data:"):
+            i = low.find(token)
+            if i != -1:
+                return line[i + len(token):].strip()
+        return None
+
+    def feed_line(self, line: str):
+        """Xử lý 1 dòng từ fixture; trả về event đã phát (hoặc None nếu dòng không liên quan)."""
+        s = line.strip()
+        up = s.upper()
+
+        if up.startswith("START"):
+            return self._emit(StateEvent("START", s))
+        if up.startswith("WAITING"):
+            return self._emit(StateEvent("WAITING", s))
+
+        if up.startswith("OK"):
+            status = "OK"
+        elif up.startswith("NG"):
+            status = "NG"
+        else:
+            return None  # các dòng khác (A1=..., log firmware): không làm gì
+
+        adc_str = self.extract_adc_payload(s)
+        if adc_str is not None:
+            self.last_adc = adc_str
+        sensors = tuple(v.strip() for v in adc_str.split(",") if v.strip() != "") if adc_str is not None else ()
+
+        now = self._clock()
+        if status == "OK":
+            self.ok_count += 1
+            self.last_serial_no = self.serial_no_for(self.ok_count, now)
+        else:
+            self.ng_count += 1
+        self.total_count = self.ok_count + self.ng_count
+
+        return self._emit(ResultEvent(
+            status=status,
+            adc=self.last_adc,
+            sensors=sensors,
+            ok_count=self.ok_count,
+            ng_count=self.ng_count,
+            total_count=self.total_count,
+            serial_no=self.last_serial_no,
+            model=self.model,
+            vendor=self.vendor,
+            timestamp=now,
+            line=s,
+        ))
+
+
+# =================== RESULT LOG (CSV) ===================
+RESULT_HEADER = ["No.", "Date", "Time", "ADC Value", "Status", "S/N"]
+RESULT_SCHEMA_VERSION = 3           # 1 = header cũ 4/5 cột, 2 = RESULT_HEADER, 3 = đúng 6 cột/dòng
+RESULT_SCHEMA_FILE = "schema.csv"   # data/schema.csv: "version,<n>"
+_RESULT_FILE_RE = re.compile(r"adc_data_(\d{4}-\d{2}-\d{2})\.csv$")
+
+
+def result_file_name(day: str) -> str:
+    return f"adc_data_{day}.csv"
+
+
+def normalize_result_row(row: list, file_date: str) -> list:
+    """Đưa 1 dòng kết quả về đúng 6 cột RESULT_HEADER."""
+    # Bỏ các cột rỗng thừa ở cuối (vd. "...YAM0024,,,,,,,,,,")
+    n = len(row)
+    while n > len(RESULT_HEADER) and row[n - 1] == '':
+        n -= 1
+    if n != len(row):
+        row = row[:n]
+
+    # Các format phổ biến:
+    # - cũ (4 cột): No, Time, ADC Value, Result
+    # - mới thiếu S/N (5 cột): No, Date, Time, ADC Value, Status
+    if len(row) == 4:
+        return [row[0], file_date, row[1], row[2], row[3], '']
+    if len(row) == 5:
+        return row + ['']
+    # Không rõ format: pad/trim về 6 cột
+    return (row + [''] * 6)[:6]
+
+
+def normalize_result_file(path: str):
+    """
+    Viết lại 1 file kết quả về layout chuẩn (header RESULT_HEADER, mỗi dòng đúng 6 cột).
+    Đọc/ghi theo stream (bộ nhớ cố định), thay thế atomic (tmp + fsync + os.replace).
+
+    Trả về (size_trước, size_sau); file đã chuẩn thì giữ nguyên và trả về None.
+    """
+    m = _RESULT_FILE_RE.search(os.path.basename(path))
+    file_date = m.group(1) if m else datetime.now().strftime("%Y-%m-%d")
+
+    size_before = os.path.getsize(path)
+    if size_before == 0:
+        return None
+
+    changed = False
+    tmp_path = path + '.tmp'
+    try:
+        with open(path, 'r', encoding='utf-8', newline='') as rf, \
+                open(tmp_path, 'w', encoding='utf-8', newline='') as wf:
+            reader = csv.reader(rf)
+            writer = csv.writer(wf)
+
+            cur_header = next(reader, [])
+            if cur_header != RESULT_HEADER:
+                changed = True
+            writer.writerow(RESULT_HEADER)
+            if cur_header and cur_header[0].strip().isdigit():
+                # Không có header (dòng đầu đã là dữ liệu) -> giữ lại dòng đó
+                writer.writerow(normalize_result_row(cur_header, file_date))
+
+            for row in reader:
+                if not row:
+                    changed = True
+                    continue
+                new_row = normalize_result_row(row, file_date)
+                if new_row != row:
+                    changed = True
+                writer.writerow(new_row)
+
+            wf.flush()
+            os.fsync(wf.fileno())
+
+        if not changed:
+            os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size_before, os.path.getsize(path)
+
+
+def read_schema_version(data_dir: str) -> int:
+    try:
+        with open(os.path.join(data_dir, RESULT_SCHEMA_FILE), 'r', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) >= 2 and row[0].strip().lower() == "version":
+                    return int(row[1])
+    except (OSError, ValueError):
+        pass
+    return 1
+
+
+def write_schema_version(data_dir: str, version: int):
+    path = os.path.join(data_dir, RESULT_SCHEMA_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerow(["version", version])
+    os.replace(tmp_path, path)
+
+
+def migrate_result_files(data_dir: str, max_workers: int = 4, force: bool = False) -> dict:
+    """
+    Chạy 1 lần (lúc khởi động / sang ngày mới): chuẩn hoá mọi file kết quả trong data/
+    (header cũ, cột rỗng thừa cuối dòng) lên RESULT_SCHEMA_VERSION, song song, mỗi file
+    được thay thế atomic. Ghi version vào data/schema.csv khi xong — các lần sau chỉ đọc
+    file này rồi bỏ qua (force=True để chạy lại).
+
+    Trả về {"upgraded": [...], "failed": {path: lỗi}, "bytes_before": n, "bytes_after": n};
+    có lỗi thì không ghi version để lần sau chạy lại.
+    """
+    summary = {"upgraded": [], "failed": {}, "bytes_before": 0, "bytes_after": 0}
+    if not os.path.isdir(data_dir):
+        return summary
+    if not force and read_schema_version(data_dir) >= RESULT_SCHEMA_VERSION:
+        return summary
+
+    paths = sorted(glob.glob(os.path.join(data_dir, result_file_name("*"))))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {path: pool.submit(normalize_result_file, path) for path in paths}
+    for path, future in futures.items():
+        try:
+            sizes = future.result()
+        except Exception as e:
+            summary["failed"][path] = str(e)
+            continue
+        if sizes:
+            summary["upgraded"].append(path)
+            summary["bytes_before"] += sizes[0]
+            summary["bytes_after"] += sizes[1]
+
+    if not summary["failed"]:
+        write_schema_version(data_dir, RESULT_SCHEMA_VERSION)
+    return summary
+
+
+def run_normalize(data_dir: str):
+    """CLI: chuẩn hoá toàn bộ data/ và in số byte tiết kiệm được."""
+    summary = migrate_result_files(data_dir, force=True)
+    for path in summary["upgraded"]:
+        print(f"normalized {os.path.basename(path)}")
+    for path, err in summary["failed"].items():
+        print(f"FAILED {os.path.basename(path)}: {err}")
+    saved = summary["bytes_before"] - summary["bytes_after"]
+    print(f"{len(summary['upgraded'])} file(s) rewritten, "
+          f"{summary['bytes_before']} -> {summary['bytes_after']} bytes ({saved} bytes saved)")
+    return 1 if summary["failed"] else 0
+
+
+def read_last_line(path: str, block_size: int = 4096) -> bytes:
+    """Đọc dòng cuối của file bằng cách seek từ cuối file (không đọc cả file)."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+            stripped = data.rstrip(b"\r\n")
+            idx = max(stripped.rfind(b"\n"), stripped.rfind(b"\r"))
+            if idx != -1:
+                return stripped[idx + 1:]
+        return data.rstrip(b"\r\n")
+
+
+def last_row_no(path: str) -> int:
+    """No. của dòng cuối trong file kết quả (0 nếu chỉ có header / file rỗng)."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    last = read_last_line(path).decode('utf-8', errors='ignore')
+    first = last.split(",", 1)[0].strip()
+    if first.isdigit():
+        return int(first)
+    if first.lower() == "no.":
+        return 0
+    # Dòng cuối hỏng (ghi dở?) -> đếm dòng 1 lần như cách cũ
+    with open(path, 'r', encoding='utf-8', errors='ignore') as cf:
+        return max(sum(1 for _ in cf) - 1, 0)  # trừ header
+
+
+def _csv_field(value) -> str:
+    return " ".join(str(value).split()) if value else ""
+
+
+class DailyCsvWriter:
+    """
+    Ghi kết quả append-only vào data/adc_data_YYYY-MM-DD.csv.
+
+    File handle và số No. được giữ trong RAM; chỉ khi mở file (lúc khởi động hoặc
+    sang ngày mới) mới đọc dòng cuối để lấy lại No. — chi phí mỗi lần ghi không phụ
+    thuộc số dòng đã có trong file. Header cũ đã được migrate_result_files() xử lý
+    trước đó, nên đường ghi không bao giờ phải parse header.
+    """
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.day = None
+        self.row_no = 0
+        self.migration = None   # kết quả migrate_result_files() gần nhất
+        self._file = None
+        self._writer = None
+
+    def path_for(self, day: str) -> str:
+        return os.path.join(self.data_dir, result_file_name(day))
+
+    def _open(self, day: str):
+        self.close()
+        os.makedirs(self.data_dir, exist_ok=True)
+        path = self.path_for(day)
+
+        # Sang ngày mới: migrate nếu data/ chưa ở schema hiện hành (thường chỉ đọc schema.csv)
+        self.migration = migrate_result_files(self.data_dir)
+
+        self.row_no = last_row_no(path)
+        needs_newline = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) not in (b"\n", b"\r")
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        if self._file.tell() == 0:
+            self._writer.writerow(RESULT_HEADER)
+        elif needs_newline:
+            # File bị sửa tay (Excel/Notepad) mất "\n" cuối -> không nối dòng mới vào dòng cũ
+            self._file.write("\r\n")
+        self.day = day
+
+    def write(self, result: ResultEvent):
+        day = result.timestamp.strftime("%Y-%m-%d")
+        if day != self.day or self._file is None:
+            self._open(day)  # khởi động / sang ngày mới
+        # Luôn đúng 6 cột, không có ký tự xuống dòng trong ô
+        self._writer.writerow([
+            self.row_no + 1,
+            day,
+            result.timestamp.strftime("%H:%M:%S"),
+            _csv_field(result.adc),
+            _csv_field(result.status),
+            _csv_field(result.serial_no),
+        ])
+        self._file.flush()
+        self.row_no += 1
+
+    def sync(self):
+        """fsync file đang mở (trước khi cắt journal)."""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            finally:
+                self._file = None
+                self._writer = None
+                self.day = None
+
+
+# =================== RESULT STORE (SQLite) ===================
+RESULT_DB_FILE = "results.db"
+RESULT_STORE_MODES = ("csv", "sqlite", "both")   # config.csv: "result store,<mode>"
+
+_RESULT_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id          INTEGER PRIMARY KEY,
+    ts          TEXT NOT NULL,          -- 'YYYY-MM-DD HH:MM:SS'
+    serial_no   TEXT NOT NULL DEFAULT '',
+    model       TEXT NOT NULL DEFAULT '',
+    vendor      TEXT NOT NULL DEFAULT '',
+    status      TEXT NOT NULL,
+    adc         TEXT NOT NULL DEFAULT '',
+    ok_count    INTEGER,
+    ng_count    INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_results_serial_no ON results(serial_no);
+CREATE INDEX IF NOT EXISTS idx_results_ts ON results(ts);
+CREATE INDEX IF NOT EXISTS idx_results_model ON results(model, ts);
+CREATE INDEX IF NOT EXISTS idx_results_status ON results(status, ts);
+"""
+
+
+class SqliteResultStore:
+    """
+    Lưu kết quả vào SQLite (WAL) có index theo S/N, thời gian, model và status.
+
+    Insert được gom lại và commit theo lô: khi đủ batch_size dòng hoặc khi dòng đầu tiên
+    của lô đã chờ quá max_delay giây (flush_if_due() được gọi định kỳ). CSV chỉ còn là
+    view dẫn xuất qua export_csv().
+    """
+
+    COLUMNS = ("id", "ts", "serial_no", "model", "vendor", "status", "adc", "ok_count", "ng_count")
+
+    def __init__(self, path: str, batch_size: int = 20, max_delay: float = 1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._first_pending_at = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_RESULT_DB_SCHEMA)
+        self._conn.commit()
+
+    # ---- ghi ----
+    def write(self, result: ResultEvent):
+        self.insert_row(result.timestamp.strftime("%Y-%m-%d %H:%M:%S"), result.serial_no, result.model,
+                        result.vendor, result.status, result.adc, result.ok_count, result.ng_count)
+
+    def insert_row(self, ts, serial_no="", model="", vendor="", status="", adc="", ok_count=None, ng_count=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO results (ts, serial_no, model, vendor, status, adc, ok_count, ng_count)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (ts, serial_no or "", model or "", vendor or "", status, adc or "", ok_count, ng_count),
+            )
+            self._pending += 1
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            if self._pending >= self.batch_size:
+                self._commit_locked()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def flush_if_due(self):
+        """Commit nếu lô đang chờ đã quá max_delay (gọi định kỳ từ timer/worker)."""
+        with self._lock:
+            if self._pending and time.monotonic() - self._first_pending_at >= self.max_delay:
+                self._commit_locked()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._commit_locked()
+
+    def _commit_locked(self):
+        self._conn.commit()
+        self._pending = 0
+        self._first_pending_at = None
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    # ---- truy vấn ----
+    def find_by_serial(self, serial_no: str) -> list:
+        return self.query(serial_no=serial_no)
+
+    def query(self, date_from: str = None, date_to: str = None, status: str = None,
+              model: str = None, serial_no: str = None, limit: int = None, offset: int = 0) -> list:
+        """
+        Lọc kết quả; date_from/date_to dạng 'YYYY-MM-DD' (bao gồm cả 2 đầu).
+        Trả về list dict theo COLUMNS, sắp xếp theo thời gian.
+        """
+        where, params = self._where(date_from, date_to, status, model, serial_no)
+        sql = "SELECT " + ", ".join(self.COLUMNS) + " FROM results" + where
+        sql += " ORDER BY ts, id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def count(self, date_from: str = None, date_to: str = None, status: str = None,
+              model: str = None, serial_no: str = None) -> int:
+        """Số dòng khớp bộ lọc (cùng tham số với query())."""
+        where, params = self._where(date_from, date_to, status, model, serial_no)
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results" + where, params).fetchone()[0]
+
+    @staticmethod
+    def _where(date_from, date_to, status, model, serial_no):
+        where, params = [], []
+        if serial_no:
+            where.append("serial_no = ?")
+            params.append(serial_no)
+        if date_from:
+            where.append("ts >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("ts < ?")
+            params.append(date_to + "\x7f")  # hết ngày date_to
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if model:
+            where.append("model = ?")
+            params.append(model)
+        return (" WHERE " + " AND ".join(where) if where else ""), params
+
+    def count_by_status(self, day: str) -> dict:
+        """{status: số dòng} trong 1 ngày ('YYYY-MM-DD')."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM results WHERE ts >= ? AND ts < ? GROUP BY status",
+                (day, day + "\x7f"),
+            ).fetchall()
+        return dict(rows)
+
+    def export_csv(self, path: str, date_from: str = None, date_to: str = None) -> int:
+        """Xuất kết quả ra CSV cùng layout RESULT_HEADER (No. đánh lại theo từng ngày)."""
+        rows = self.query(date_from=date_from, date_to=date_to)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(RESULT_HEADER)
+            day, no = None, 0
+            for r in rows:
+                d, t = r["ts"].split(" ", 1)
+                no = no + 1 if d == day else 1
+                day = d
+                writer.writerow([no, d, t, r["adc"], r["status"], r["serial_no"]])
+        return len(rows)
+
+    def import_csv_files(self, data_dir: str) -> int:
+        """
+        Nạp các file adc_data_*.csv (đã chuẩn hoá) vào DB — dùng khi chuyển sang SQLite.
+        Chạy lại nhiều lần không tạo dòng trùng: mỗi dòng CSV chỉ được thêm nếu DB chưa có đủ
+        số dòng giống hệt (ts, S/N, status, ADC) của ngày đó — kể cả dòng đã ghi ở mode "both".
+        """
+        n = 0
+        for path in sorted(glob.glob(os.path.join(data_dir, result_file_name("*")))):
+            day = _RESULT_FILE_RE.search(path).group(1)
+            with self._lock:
+                existing = Counter(self._conn.execute(
+                    "SELECT ts, serial_no, status, adc FROM results WHERE ts >= ? AND ts < ?",
+                    (day, day + "\x7f"),
+                ).fetchall())
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                for row in reader:
+                    if len(row) < 6 or not row[0].strip().isdigit():
+                        continue
+                    key = (f"{row[1]} {row[2]}", row[5], row[4], row[3])
+                    if existing[key] > 0:
+                        existing[key] -= 1   # đã có trong DB
+                        continue
+                    self.insert_row(key[0], serial_no=row[5], status=row[4], adc=row[3])
+                    n += 1
+        self.flush()
+        return n
+
+
+def run_result_db(data_dir: str, args):
+    """CLI cho result store: --db-import / --find-sn / --db-export."""
+    store = SqliteResultStore(os.path.join(data_dir, RESULT_DB_FILE))
+    try:
+        if args.db_import:
+            print(f"imported {store.import_csv_files(data_dir)} row(s)")
+        if args.find_sn:
+            t0 = time.perf_counter()
+            rows = store.find_by_serial(args.find_sn)
+            for r in rows:
+                print(f"{r['ts']}  {r['status']}  adc={r['adc']}  model={r['model']}")
+            print(f"{len(rows)} row(s) in {(time.perf_counter() - t0) * 1000:.2f} ms")
+        if args.db_export:
+            n = store.export_csv(args.db_export, args.date_from, args.date_to)
+            print(f"exported {n} row(s) to {args.db_export}")
+    finally:
+        store.close()
+    return 0
+
+
+# =================== BATCH LABELS ===================
+BATCH_PRINT_TARGET = "print"   # --batch-labels print -> in qua backend trong config.csv
+
+_batch_encoder = None          # QrEncoder riêng của mỗi process con
+
+
+def batch_qr_matrix(serial_no: str) -> list:
+    """Chạy trong process con: mã hoá 1 S/N thành ma trận module QR (list bool, gồm viền)."""
+    global _batch_encoder
+    if _batch_encoder is None:
+        _batch_encoder = QrEncoder()
+    return _batch_encoder.encode(serial_no).get_matrix()
+
+
+def select_batch_labels(data_dir: str, date_from: str = None, date_to: str = None,
+                        sn_from: str = None, sn_to: str = None, model: str = "",
+                        result_store: str = "csv") -> list:
+    """
+    Các label cần in lại: [(S/N, model), ...] của các kết quả OK, lọc theo ngày và/hoặc
+    khoảng S/N (so sánh chuỗi, bao gồm 2 đầu), bỏ S/N trùng. Nguồn theo config "result store"
+    như GUI: sqlite/both -> data/results.db (nếu có), csv -> các file adc_data_*.csv (không lưu
+    model -> dùng `model`). Ở chế độ csv, results.db cũ (nếu còn) không được đọc vì đã lỗi thời.
+    """
+    rows = []
+    db_path = os.path.join(data_dir, RESULT_DB_FILE)
+    if result_store in ("sqlite", "both") and os.path.exists(db_path):
+        store = SqliteResultStore(db_path)
+        try:
+            rows = [(r["serial_no"], r["model"] or model)
+                    for r in store.query(date_from=date_from, date_to=date_to, status="OK")]
+        finally:
+            store.close()
+    else:
+        for path in sorted(glob.glob(os.path.join(data_dir, result_file_name("*")))):
+            day = _RESULT_FILE_RE.search(path).group(1)
+            if (date_from and day < date_from) or (date_to and day > date_to):
+                continue
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                for row in csv.reader(f):
+                    if len(row) >= 6 and row[0].strip().isdigit() and row[4] == "OK":
+                        rows.append((row[5], model))
+
+    labels, seen = [], set()
+    for serial_no, m in rows:
+        if not serial_no or serial_no in seen:
+            continue
+        if (sn_from and serial_no < sn_from) or (sn_to and serial_no > sn_to):
+            continue
+        seen.add(serial_no)
+        labels.append((serial_no, m))
+    return labels
+
+
+def render_batch_labels(labels, vendor: str = "", workers: int = None):
+    """
+    Sinh (S/N, model, QImage) theo đúng thứ tự `labels`. Phần nặng (mã hoá QR) chạy song song
+    trên process pool; process chính chỉ đóng ma trận lên template nên dùng được QPainter.
+    """
+    renderer = LabelRenderer()
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(labels) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        matrices = pool.map(batch_qr_matrix, [sn for sn, _ in labels], chunksize=chunksize)
+        for (serial_no, model), matrix in zip(labels, matrices):
+            yield serial_no, model, renderer.render_matrix(matrix, model, vendor)
+
+
+def write_label_pages(printer: QPrinter, images) -> int:
+    """In mỗi label 1 trang trong cùng 1 tài liệu (1 job máy in / 1 file PDF)."""
+    painter = QPainter()
+    n = 0
+    for image in images:
+        if n == 0:
+            if not painter.begin(printer):
+                raise RuntimeError("Không mở được máy in")
+        elif not printer.newPage():
+            raise RuntimeError("Không sang được trang mới")
+        _fit_label(painter, printer, image)
+        n += 1
+    if n:
+        painter.end()
+    return n
+
+
+def run_batch_labels(data_dir: str, args):
+    """CLI --batch-labels <file.pdf | print>: in lại hàng loạt label theo ngày / khoảng S/N."""
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])  # giữ sống tới hết hàm
+    cfg = ConfigStore(os.path.join(app_dir(), "config.csv")).load()
+    labels = select_batch_labels(data_dir, args.date_from, args.date_to, args.sn_from, args.sn_to,
+                                 args.batch_model or "", cfg.result_store)
+    if not labels:
+        print("no label matched")
+        return 1
+
+    t0 = time.perf_counter()
+    target = args.batch_labels
+    backend = None
+    if target.lower() == BATCH_PRINT_TARGET:
+        backend = make_print_backend(cfg.print_backend, cfg.printer_target)
+    if backend is not None and not backend.needs_image:
+        # ZPL/TSPL: máy in tự vẽ QR, chỉ cần gửi lệnh
+        for i, (serial_no, model) in enumerate(labels, 1):
+            backend.send(PrintJob(i, serial_no, None, model))
+        n = len(labels)
+    else:
+        printer = QPrinter(QPrinter.HighResolution)
+        printer.setPageSize(QPageSize(QSizeF(LABEL_MM_W, LABEL_MM_H), QPageSize.Millimeter))
+        printer.setFullPage(True)
+        if backend is None:
+            printer.setOutputFormat(QPrinter.PdfFormat)
+            printer.setOutputFileName(target)
+        images = (img for _, _, img in render_batch_labels(labels, cfg.vendor_code, args.workers))
+        n = write_label_pages(printer, images)
+    dt = time.perf_counter() - t0
+    print(f"{n} label(s) -> {target} in {dt:.2f} s ({n / dt:.0f} labels/s)")
+    return 0
+
+
+# =================== COUNTER STORE ===================
+COUNTER_COALESCE_DELAY = 0.5  # s — gom các lần lưu counter liên tiếp thành 1 lần ghi
+
+
+def atomic_write_rows(path: str, rows):
+    """Ghi file CSV atomic: tmp + fsync + os.replace (crash giữa chừng không để lại file rỗng)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def count_results_in_csv(path: str):
+    """Đếm (OK, NG) trong 1 file kết quả ngày (stream, dùng khi khởi động)."""
+    ok = ng = 0
+    if not os.path.exists(path):
+        return ok, ng
+    with open(path, 'r', encoding='utf-8', errors='ignore', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 5:
+                continue
+            status = row[4].strip().upper()
+            if status == "OK":
+                ok += 1
+            elif status == "NG":
+                ng += 1
+    return ok, ng
+
+
+class CounterStore:
+    """
+    Lưu bộ đếm OK/NG/Total vào data.csv:
+        OK,xxxx
+        NG,xxxx
+        Total,xxxx
+        Date,YYYY-MM-DD
+    Ghi atomic; các lần save() trong vòng `delay` giây được gom thành 1 lần ghi (trên timer
+    thread, không chặn GUI). Ngày được lưu trong file thay vì dựa vào mtime.
+    """
+
+    def __init__(self, path: str, delay: float = COUNTER_COALESCE_DELAY):
+        self.path = path
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._snapshot = None   # (ok, ng, total, day) chưa ghi
+        self._timer = None
+
+    def load(self):
+        """Trả về (ok, ng, total, day) hoặc None nếu file không có / hỏng."""
+        if not os.path.exists(self.path):
+            return None
+        values, day = {}, None
+        try:
+            with open(self.path, "r", encoding="utf-8", newline='') as f:
+                for row in csv.reader(f):
+                    if len(row) < 2:
+                        continue
+                    if row[0] in ("OK", "NG", "Total"):
+                        values[row[0]] = int(row[1])
+                    elif row[0] == "Date":
+                        day = row[1].strip()
+        except (OSError, ValueError):
+            return None
+        if "OK" not in values or "NG" not in values:
+            return None
+        if not day:
+            # File cũ chưa có dòng Date -> dựa vào mtime như trước
+            day = datetime.fromtimestamp(os.path.getmtime(self.path)).strftime("%Y-%m-%d")
+        return values["OK"], values["NG"], values.get("Total", values["OK"] + values["NG"]), day
+
+    def save(self, ok: int, ng: int, total: int, day: str):
+        with self._lock:
+            self._snapshot = (ok, ng, total, day)
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            snapshot, self._snapshot = self._snapshot, None
+            self._timer = None
+            if snapshot is None:
+                return
+            ok, ng, total, day = snapshot
+            try:
+                atomic_write_rows(self.path, [
+                    ["OK", f"{ok:04d}"],
+                    ["NG", f"{ng:04d}"],
+                    ["Total", f"{total:04d}"],
+                    ["Date", day],
+                ])
+            except OSError as e:
+                print("Error saving counter:", e)
+
+    def close(self):
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+
+# =================== CONFIG STORE ===================
+CONFIG_FLUSH_DELAY = 1.0  # s — debounce: chỉ ghi config.csv khi ngừng thay đổi 1 giây
+
+# key trong config.csv (không phân biệt hoa/thường) -> field của StationConfig
+CONFIG_KEYS = {
+    "id": "id",
+    "name": "name",
+    "vendor code": "vendor_code",
+    "part code": "part_code",
+    "com port": "com_port",
+    "result store": "result_store",
+    "hot reload": "hot_reload",
+    "print backend": "print_backend",
+    "printer target": "printer_target",
+    "label archive": "label_archive",
+    "log lines": "log_lines",
+}
+
+# key chỉ được đọc lúc khởi động (mở DB / backend máy in / watcher) -> reload chỉ báo cần restart
+CONFIG_RESTART_KEYS = ("result store", "print backend", "printer target", "hot reload")
+
+
+@dataclass
+class StationConfig:
+    """Giá trị đã parse từ config.csv."""
+    id: str = ""
+    name: str = ""
+    vendor_code: str = ""
+    part_code: str = ""
+    com_port: str = ""
+    result_store: str = "csv"   # csv | sqlite | both
+    hot_reload: bool = True     # tự đọc lại config.csv khi bị sửa ngoài chương trình
+    print_backend: str = "qt"   # qt (QPrinter raster) | zpl | tspl
+    printer_target: str = ""    # tcp://host:9100 | file:path | dev:path (backend zpl/tspl)
+    label_archive: str = "last" # off | last (qr_code.png) | per-sn (labels/<ngày>/<S/N>.png)
+    log_lines: int = 20         # số dòng giữ trong ô log (tối đa LOG_MAX_LINES_LIMIT)
+
+
+class ConfigStore:
+    """
+    config.csv (2 cột key,value) được đọc 1 lần và giữ trong RAM.
+
+    set() chỉ cập nhật RAM rồi hẹn ghi (debounce CONFIG_FLUSH_DELAY, trên timer thread);
+    file được ghi atomic, giữ nguyên thứ tự và các key không biết. reload() đọc lại file
+    khi kỹ sư sửa tay (vd. từ QFileSystemWatcher), các key vừa set() chưa ghi vẫn được giữ.
+    """
+
+    def __init__(self, path: str, delay: float = CONFIG_FLUSH_DELAY):
+        self.path = path
+        self.delay = delay
+        self.config = StationConfig()
+        self._rows = []          # [[key, value], ...] đúng thứ tự trong file
+        self._dirty = set()      # key (lower) đã set() nhưng chưa ghi
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @staticmethod
+    def _read_rows(path: str) -> list:
+        rows = []
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.reader(f):
+                if not row or len(row) < 2:
+                    continue
+                rows.append([row[0].strip(), row[1].strip()])
+        return rows
+
+    def _parse(self):
+        cfg = StationConfig()
+        for k, v in self._rows:
+            field = CONFIG_KEYS.get(k.lower())
+            if field == "result_store":
+                if v.lower() in RESULT_STORE_MODES:
+                    cfg.result_store = v.lower()
+            elif field == "label_archive":
+                if v.lower() in LABEL_ARCHIVE_MODES:
+                    cfg.label_archive = v.lower()
+            elif field == "log_lines":
+                if v.isdigit() and int(v) > 0:
+                    cfg.log_lines = int(v)
+            elif field == "hot_reload":
+                cfg.hot_reload = v.lower() not in ("0", "no", "false", "off")
+            elif field:
+                setattr(cfg, field, v)
+        self.config = cfg
+
+    def load(self) -> StationConfig:
+        with self._lock:
+            self._rows = self._read_rows(self.path) if os.path.exists(self.path) else []
+            self._parse()
+            return self.config
+
+    def reload(self) -> bool:
+        """Đọc lại file; True nếu nội dung khác với bản trong RAM."""
+        try:
+            disk_rows = self._read_rows(self.path)
+        except OSError:
+            return False  # file đang được thay thế / bị khoá
+        with self._lock:
+            # Key chưa ghi được thay giá trị tại đúng dòng của nó (như set()), chỉ key
+            # chưa có trong file mới thêm vào cuối — giữ thứ tự file, reload không đổi gì -> False
+            pending = OrderedDict((k.lower(), [k, v]) for k, v in self._rows if k.lower() in self._dirty)
+            merged = []
+            for k, v in disk_rows:
+                row = pending.pop(k.lower(), None)
+                merged.append([k, row[1]] if row is not None else [k, v])
+            merged.extend(pending.values())
+            if merged == self._rows:
+                return False
+            self._rows = merged
+            self._parse()
+            return True
+
+    def set(self, key_name: str, value: str):
+        """Update/append 1 key-value (chỉ trong RAM); file được ghi sau CONFIG_FLUSH_DELAY."""
+        key = key_name.strip().lower()
+        with self._lock:
+            for row in self._rows:
+                if row[0].lower() == key:
+                    if row[1] == value:
+                        return
+                    row[1] = value
+                    break
+            else:
+                self._rows.append([key_name, value])
+            self._parse()
+            self._dirty.add(key)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            if not self._dirty:
+                return
+            try:
+                atomic_write_rows(self.path, self._rows)
+                self._dirty.clear()
+            except OSError as e:
+                print("Error saving config:", e)
+
+    def close(self):
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+
+# =================== PERSISTENCE (write-behind) ===================
+JOURNAL_FILE = "journal.csv"   # data/journal.csv
+
+
+def result_to_row(result: ResultEvent) -> list:
+    return [result.timestamp.isoformat(), result.status, result.adc, result.serial_no, result.model,
+            result.vendor, result.ok_count, result.ng_count, result.total_count, result.line]
+
+
+def result_from_row(row: list) -> ResultEvent:
+    ts, status, adc, serial_no, model, vendor, ok, ng, total, line = row[:10]
+    return ResultEvent(
+        status=status,
+        adc=adc,
+        sensors=tuple(v.strip() for v in adc.split(",") if v.strip() != ""),
+        ok_count=int(ok),
+        ng_count=int(ng),
+        total_count=int(total),
+        serial_no=serial_no,
+        model=model,
+        vendor=vendor,
+        timestamp=datetime.fromisoformat(ts),
+        line=line,
+    )
+
+
+class ResultJournal:
+    """
+    Journal nhỏ cho kết quả chưa lưu xong: "R,seq,..." khi nhận kết quả, "D,seq" khi đã lưu.
+    Khởi động lại sau crash -> pending() trả về các kết quả chưa có "D" để lưu lại.
+    Khi mọi kết quả đã lưu, file được cắt về rỗng; nếu còn kết quả lưu lỗi thì journal được
+    ghi lại chỉ với các "R" chưa xong — kết quả lỗi không bao giờ bị cắt mất.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._outstanding = {}      # seq -> row: đã append() nhưng chưa mark_done()
+        self._compactable = False   # có "D" mới kể từ lần compact trước
+        self._pending_rows = self._load()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, 'a', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        records, done = {}, set()
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                try:
+                    if row[0] == "R" and len(row) >= 12:
+                        records[int(row[1])] = row[2:]
+                    elif row[0] == "D":
+                        done.add(int(row[1]))
+                except (IndexError, ValueError):
+                    continue  # dòng ghi dở lúc crash
+        self._seq = max(records, default=0)
+        return {seq: records[seq] for seq in sorted(records) if seq not in done}
+
+    def pending(self) -> list:
+        """Các kết quả của lần chạy trước chưa được lưu (đã parse sang ResultEvent)."""
+        events = []
+        for row in self._pending_rows.values():
+            try:
+                events.append(result_from_row(row))
+            except (ValueError, TypeError):
+                continue
+        with self._lock:
+            self._pending_rows = {}  # người gọi submit lại -> có seq mới trong journal
+        return events
+
+    def append(self, result: ResultEvent) -> int:
+        row = result_to_row(result)
+        with self._lock:
+            self._seq += 1
+            self._outstanding[self._seq] = row
+            self._writer.writerow(["R", self._seq] + row)
+            self._file.flush()
+            return self._seq
+
+    def mark_done(self, seq: int):
+        with self._lock:
+            self._outstanding.pop(seq, None)
+            self._compactable = True
+            self._writer.writerow(["D", seq])
+            self._file.flush()
+
+    def sync(self):
+        """fsync journal (gọi từ worker, không chặn GUI)."""
+        with self._lock:
+            os.fsync(self._file.fileno())
+
+    def compact(self):
+        """
+        Cắt journal về rỗng nếu mọi kết quả đã lưu xong; còn kết quả chưa xong (vd. lưu lỗi)
+        thì ghi lại file (atomic) chỉ với các dòng "R" đó.
+        """
+        with self._lock:
+            if self._file.tell() == 0:
+                return
+            keep = dict(self._pending_rows)
+            keep.update(self._outstanding)
+            if not keep:
+                self._file.seek(0)
+                self._file.truncate()
+                self._file.flush()
+            elif self._compactable:
+                self._file.close()
+                atomic_write_rows(self.path, [["R", seq] + keep[seq] for seq in sorted(keep)])
+                self._open()
+            self._compactable = False
+
+    def close(self):
+        self.compact()
+        with self._lock:
+            self._file.close()
+
+
+class PersistenceWorker(threading.Thread):
+    """
+    Thread lưu kết quả phía sau (write-behind) với hàng đợi giới hạn, giữ đúng thứ tự.
+
+    submit() ghi journal rồi đưa kết quả vào queue và trả về ngay — GUI hiển thị OK/NG
+    không phải chờ đĩa. Worker gọi lần lượt các sink (save_result(result)), sau đó
+    đánh dấu "done" trong journal. stop() xử lý hết queue, flush các sink rồi mới thoát.
+    """
+
+    _STOP = object()
+
+    def __init__(self, save_result, journal: ResultJournal, flush=None, on_error=None,
+                 maxsize: int = 256, idle_interval: float = 0.5):
+        super().__init__(name="PersistenceWorker", daemon=True)
+        self._save_result = save_result
+        self._flush = flush
+        self._on_error = on_error
+        self.journal = journal
+        self.idle_interval = idle_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def submit(self, result: ResultEvent):
+        seq = self.journal.append(result)
+        self._queue.put((seq, result))  # queue đầy -> chờ (journal đã giữ kết quả)
+
+    def stop(self, timeout: float = 10.0):
+        self._queue.put(self._STOP)
+        self.join(timeout)
+
+    def run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_interval)
+            except queue.Empty:
+                self._idle()
+                continue
+            if item is self._STOP:
+                self._idle()
+                return
+            seq, result = item
+            try:
+                self.journal.sync()
+                self._save_result(result)
+                self.journal.mark_done(seq)
+            except Exception as e:
+                # Kết quả lỗi vẫn nằm trong journal (chưa "D", compact() giữ lại) -> lưu lại lần chạy sau
+                if self._on_error is not None:
+                    self._on_error(str(e))
+            if self._queue.empty():
+                self._idle()
+
+    def _idle(self):
+        try:
+            # flush() trả về True khi mọi sink đã xuống đĩa -> mới được cắt journal
+            if self._flush is None or self._flush():
+                self.journal.compact()
+        except Exception as e:
+            if self._on_error is not None:
+                self._on_error(str(e))
+
+
+def bench_engine(n_cycles=20000):
+    """Đo thời gian xử lý dòng của StationEngine (không GUI, không lưu file)."""
+    engine = StationEngine(model="DJ9600267A", vendor="EBA3")
+    engine.set_counters(0, 0)
+    results = []
+    engine.subscribe(results.append)
+    lines = ["START", "A1=512 A2=498 A3=505 A4=511 A5=503", "OK:data=0,0,0,0,0",
+             "START", "NG:data=1,0,0,1,0"]
+    t0 = time.perf_counter()
+    for _ in range(n_cycles):
+        for line in lines:
+            engine.feed_line(line)
+    dt = time.perf_counter() - t0
+    n_lines = n_cycles * len(lines)
+    print(f"{n_lines} lines, {len(results)} events in {dt * 1000:.1f} ms "
+          f"({dt / n_lines * 1e6:.2f} us/line)")
+
+
+def run_replay(path: str):
+    """Chạy headless: đưa các dòng trong file log qua StationEngine và in ra event."""
+    engine = StationEngine()
+    engine.set_counters(0, 0)
+    engine.subscribe(print)
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            if line.strip():
+                engine.feed_line(line)
+
+
+# =================== SENSOR WIDGET ===================
+SENSOR_OK_COLOR = QColor(0, 0, 255)     # = COLOR_BLUE
+SENSOR_NG_COLOR = QColor(255, 0, 0)     # = COLOR_RED
+SENSOR_RADIUS = 20                      # px, như border-radius trong COLOR_BLUE/COLOR_RED
+
+
+class SensorArrayWidget(QWidget):
+    """
+    N đèn sensor vẽ bằng paintEvent từ 1 bitmask (bit i = 1 -> sensor i đỏ/NG).
+
+    Thay cho các QLabel + setStyleSheet (mỗi lần gọi là parse lại stylesheet và polish lại
+    widget): brush được tạo 1 lần, set_mask() chỉ update() vùng của các đèn thực sự đổi màu.
+    Vị trí từng đèn là QRect tuỳ ý trong widget nên không giới hạn 5 sensor.
+    """
+
+    def __init__(self, rects, texts=None, parent=None):
+        super().__init__(parent)
+        self.rects = [QRect(r) for r in rects]
+        self.texts = list(texts or [""] * len(self.rects))
+        self.mask = 0
+        self._brushes = (QBrush(SENSOR_OK_COLOR), QBrush(SENSOR_NG_COLOR))
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)  # nền (ảnh fixture) vẫn nhận chuột
+
+    @classmethod
+    def replace_labels(cls, labels):
+        """Tạo widget phủ đúng vị trí các QLabel (cùng parent, font, chữ) rồi bỏ các QLabel đó."""
+        bounds = QRect()
+        for label in labels:
+            bounds = bounds.united(label.geometry())
+        widget = cls([label.geometry().translated(-bounds.topLeft()) for label in labels],
+                     [label.text() for label in labels], labels[0].parentWidget())
+        widget.setFont(labels[0].font())
+        widget.setGeometry(bounds)
+        for label in labels:
+            label.hide()
+            label.deleteLater()
+        widget.show()
+        widget.raise_()
+        return widget
+
+    def set_mask(self, mask: int):
+        changed = (self.mask ^ mask) & ((1 << len(self.rects)) - 1)
+        self.mask = mask
+        if not changed:
+            return
+        region = QRect()
+        for i, rect in enumerate(self.rects):
+            if changed >> i & 1:
+                region = region.united(rect)
+        self.update(region)
+
+    def set_values(self, values):
+        self.set_mask(self.mask_for(values))
+
+    def mask_for(self, values) -> int:
+        """Giá trị sensor ("0"/"1"...) -> bitmask; '1' là NG."""
+        mask = 0
+        for i, v in enumerate(values[:len(self.rects)]):
+            if v.strip() == "1":
+                mask |= 1 << i
+        return mask
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        clip = event.rect()
+        for i, rect in enumerate(self.rects):
+            if not rect.intersects(clip):
+                continue
+            painter.setBrush(self._brushes[self.mask >> i & 1])
+            radius = min(SENSOR_RADIUS, rect.width() / 2, rect.height() / 2)
+            painter.drawRoundedRect(rect, radius, radius)
+        painter.setPen(self.palette().windowText().color())
+        for rect, text in zip(self.rects, self.texts):
+            if text and rect.intersects(clip):
+                painter.drawText(rect, Qt.AlignCenter, text)
+        painter.end()
+
+
+def bench_sensor_widgets(n: int = 2000):
+    """Mỗi chu kỳ START (reset) + NG (tô màu): 5 QLabel setStyleSheet vs SensorArrayWidget."""
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    values = ("0", "1", "0", "0", "1")
+    host = QWidget()
+    host.resize(400, 100)
+    labels = []
+    for i in range(5):
+        label = QLabel("Terminal" if i >= 3 else "", host)
+        label.setGeometry(10 + 70 * i, 10, 51, 51)
+        labels.append(label)
+    host.show()
+    app.processEvents()
+
+    t0 = time.perf_counter()
+    for _ in range(n):
+        for label in labels:
+            label.setStyleSheet(COLOR_BLUE)
+        for label, v in zip(labels, values):
+            label.setStyleSheet(COLOR_RED if v == "1" else COLOR_BLUE)
+        app.processEvents()
+    legacy = (time.perf_counter() - t0) / n
+
+    array = SensorArrayWidget.replace_labels(labels)
+    app.processEvents()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        array.set_mask(0)
+        array.set_values(values)
+        app.processEvents()
+    fast = (time.perf_counter() - t0) / n
+    print(f"sensors: stylesheet {legacy * 1e6:.1f} us/cycle, SensorArrayWidget {fast * 1e6:.1f} us/cycle "
+          f"({legacy / fast:.1f}x)")
+    return app
+
+
+# =================== LOG CONSOLE ===================
+LOG_MAX_LINES = 20              # mặc định, config.csv: "log lines,<n>"
+LOG_MAX_LINES_LIMIT = 10000
+LOG_FLUSH_INTERVAL_MS = 50      # gom các dòng log trong 50 ms thành 1 lần vẽ
+
+
+class LogConsole:
+    """
+    Log giới hạn số dòng trên QPlainTextEdit, chi phí mỗi dòng không đổi.
+
+    Dòng mới vào hàng đợi vòng (deque maxlen = max_lines) và được đẩy ra widget mỗi
+    LOG_FLUSH_INTERVAL_MS bằng 1 lần appendPlainText; setMaximumBlockCount để Qt tự bỏ các
+    dòng cũ nhất — không đọc lại/dựng lại toàn bộ text như trước.
+    """
+
+    def __init__(self, view, max_lines: int = LOG_MAX_LINES, interval_ms: int = LOG_FLUSH_INTERVAL_MS):
+        self.view = view
+        self._pending = deque()
+        self._timer = QTimer(view)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.flush)
+        self.set_max_lines(max_lines)
+
+    def set_max_lines(self, max_lines: int):
+        self.max_lines = max(1, min(int(max_lines), LOG_MAX_LINES_LIMIT))
+        self._pending = deque(self._pending, maxlen=self.max_lines)
+        self.view.setMaximumBlockCount(self.max_lines)
+
+    def append(self, text_line: str):
+        self._pending.append(text_line)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        if not self._pending:
+            return
+        text = "\n".join(self._pending)
+        self._pending.clear()
+        self.view.appendPlainText(text)
+        self.view.moveCursor(QTextCursor.End)
+
+    def clear(self):
+        self._pending.clear()
+        self.view.clear()
+
+
+def _legacy_append_log(view, text_line, max_lines=20):
+    """append_limited_log cũ (đọc lại & dựng lại toàn bộ text) — chỉ giữ lại để benchmark."""
+    cursor = view.textCursor()
+    cursor.movePosition(QTextCursor.End)
+    cursor.insertText(text_line + '\n')
+    lines = view.toPlainText().splitlines()
+    if len(lines) > max_lines:
+        view.clear()
+        view.appendPlainText('\n'.join(lines[-max_lines:]))
+    view.moveCursor(QTextCursor.End)
+
+
+def bench_log_console(n: int = 2000):
+    """So sánh thời gian/dòng log: cách cũ vs LogConsole với max_lines 20 và 2000."""
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    lines = [f"A1={i % 4096} A2={i * 7 % 4096} A3=0 A4=1 A5=2" for i in range(n)]
+    for max_lines in (20, 2000):
+        view = QPlainTextEdit()
+        t0 = time.perf_counter()
+        for line in lines:
+            _legacy_append_log(view, line, max_lines)
+        legacy = (time.perf_counter() - t0) / n
+
+        view = QPlainTextEdit()
+        console = LogConsole(view, max_lines)
+        t0 = time.perf_counter()
+        for i, line in enumerate(lines):
+            console.append(line)
+            if i % 20 == 19:
+                console.flush()   # ~1 lần vẽ mỗi LOG_FLUSH_INTERVAL_MS khi dòng tới dồn dập
+        console.flush()
+        fast = (time.perf_counter() - t0) / n
+        print(f"log max_lines={max_lines}: legacy {legacy * 1e6:.1f} us/line, "
+              f"LogConsole {fast * 1e6:.1f} us/line ({legacy / fast:.1f}x)")
+    return app
+
+
+# =================== RESULT HISTORY (TABLE VIEW) ===================
+HISTORY_COLUMNS = ("No.", "Time", "ADC Value", "Result", "S/N")
+HISTORY_PAGE_SIZE = 200      # số dòng mỗi lần đọc từ result store
+HISTORY_MAX_PAGES = 50       # số trang giữ trong RAM (LRU)
+HISTORY_SCAN_CHUNK = 2000    # số dòng mỗi lần đọc khi lọc trên thread nền
+HISTORY_CSV_SOURCES = 4      # số file ngày giữ lại chỉ mục dòng (CsvHistorySource)
+_EMPTY_HISTORY_ROW = ("",) * len(HISTORY_COLUMNS)
+
+
+def history_row(result: ResultEvent, no: int) -> list:
+    return [str(no), result.timestamp.strftime("%H:%M:%S"), result.adc, result.status, result.serial_no]
+
+
+class SqliteHistorySource:
+    """Kết quả của 1 ngày trong SqliteResultStore, đọc theo trang (LIMIT/OFFSET trên index ts)."""
+
+    def __init__(self, store: SqliteResultStore, day: str):
+        self.store = store
+        self.day = day
+
+    def count(self) -> int:
+        return self.store.count(self.day, self.day)
+
+    def fetch(self, offset: int, limit: int) -> list:
+        rows = self.store.query(date_from=self.day, date_to=self.day, limit=limit, offset=offset)
+        return [[str(offset + i + 1), r["ts"][11:], r["adc"], r["status"], r["serial_no"]]
+                for i, r in enumerate(rows)]
+
+
+class CsvHistorySource:
+    """
+    File adc_data_<ngày>.csv: count() lập chỉ mục vị trí byte của từng dòng, fetch() seek thẳng
+    tới trang cần đọc. Dòng cuối chưa ghi xong (chưa có newline) bị bỏ qua.
+
+    Chỉ mục được nối tiếp từ byte cuối đã lập chỉ mục: file append-only nên count() lần sau chỉ
+    đọc phần mới ghi thêm (MyWindow giữ lại source của các ngày vừa xem). File bị ghi lại
+    (nhỏ đi hoặc bị thay bằng os.replace) -> lập chỉ mục lại từ đầu.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._starts = []
+        self._ends = []
+        self._indexed = 0       # byte đầu tiên chưa lập chỉ mục (ngay sau 1 newline)
+        self._inode = None
+
+    def _reset(self):
+        self._starts, self._ends = [], []
+        self._indexed = 0
+
+    def count(self) -> int:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            return 0
+        if st.st_size < self._indexed or st.st_ino != self._inode:
+            self._reset()
+            self._inode = st.st_ino
+        if st.st_size > self._indexed:
+            base = self._indexed
+            with open(self.path, "rb") as f:
+                f.seek(base)
+                data = f.read(st.st_size - base)
+            pos = 0
+            if base == 0:
+                pos = data.find(b"\n") + 1   # bỏ header
+                if pos == 0:
+                    return 0
+            starts, ends = self._starts, self._ends
+            while True:
+                nl = data.find(b"\n", pos)
+                if nl == -1:
+                    break
+                if data[pos:nl].strip():
+                    starts.append(base + pos)
+                    ends.append(base + nl + 1)
+                pos = nl + 1
+            self._indexed = base + pos
+        return len(self._starts)
+
+    def fetch(self, offset: int, limit: int) -> list:
+        starts, ends = self._starts, self._ends   # count() có thể thay list khi lập chỉ mục lại
+        if limit <= 0 or offset >= len(starts):
+            return []
+        last = min(offset + limit, len(starts)) - 1
+        with open(self.path, "rb") as f:
+            f.seek(starts[offset])
+            data = f.read(ends[last] - starts[offset])
+        lines = [ln for ln in data.decode("utf-8", errors="replace").splitlines() if ln.strip()]
+        rows = []
+        for row in csv.reader(lines):
+            row += [""] * (6 - len(row))
+            rows.append([row[0], row[2], row[3], row[4], row[5]])
+        return rows
+
+
+class ResultTableModel(QAbstractTableModel):
+    """
+    Bảng kết quả của 1 ngày cho QTableView: chỉ đọc trang đang cần từ source (SQLite/CSV) và
+    giữ tối đa HISTORY_MAX_PAGES trang; kết quả mới được append() vào cuối (O(1)), không
+    đọc lại source.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.source = None
+        self.day = ""
+        self._count = 0              # số dòng trong source lúc set_source()
+        self._pages = OrderedDict()  # số trang -> [row, ...]
+        self._tail = []              # dòng append() sau khi set_source()
+        self._colors = {"OK": QColor("green"), "NG": QColor("red")}
+
+    def set_source(self, source, day: str):
+        self.beginResetModel()
+        self.source, self.day = source, day
+        self._pages.clear()
+        self._tail = []
+        try:
+            self._count = source.count() if source is not None else 0
+        except (OSError, sqlite3.Error) as e:
+            print("Error loading history:", e)
+            self._count = 0
+        self.endResetModel()
+
+    def snapshot(self):
+        """(source, số dòng trong source, bản copy các dòng append) — cho việc lọc trên thread nền."""
+        return self.source, self._count, list(self._tail)
+
+    def next_no(self) -> int:
+        """
+        No. cho dòng append() kế tiếp: No. của dòng cuối + 1, giống DailyCsvWriter (đọc No. dòng
+        cuối file) — file CSV sửa tay có thể lệch No. với số dòng. Fallback: số dòng + 1.
+        """
+        n = self.rowCount()
+        if n:
+            last = self.row(n - 1)[0]
+            if last.isdigit():
+                return int(last) + 1
+        return n + 1
+
+    def append(self, row: list):
+        r = self.rowCount()
+        self.beginInsertRows(QModelIndex(), r, r)
+        self._tail.append(row)
+        self.endInsertRows()
+
+    def row(self, r: int):
+        if r >= self._count:
+            return self._tail[r - self._count]
+        page_no, i = divmod(r, HISTORY_PAGE_SIZE)
+        page = self._pages.get(page_no)
+        if page is None:
+            start = page_no * HISTORY_PAGE_SIZE
+            try:
+                page = self.source.fetch(start, min(HISTORY_PAGE_SIZE, self._count - start))
+            except (OSError, sqlite3.Error) as e:
+                print("Error reading history:", e)
+                page = []
+            self._pages[page_no] = page
+            while len(self._pages) > HISTORY_MAX_PAGES:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(page_no)
+        return page[i] if i < len(page) else _EMPTY_HISTORY_ROW
+
+    # ---- QAbstractTableModel ----
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._count + len(self._tail)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HISTORY_COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.row(index.row())[index.column()]
+        if role == Qt.ForegroundRole and index.column() == 3:
+            return self._colors.get(self.row(index.row())[3])
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HISTORY_COLUMNS[section]
+        return None
+
+
+def history_row_matches(row, status: str, text: str) -> bool:
+    """status: "" | "OK" | "NG"; text: 1 phần S/N (chữ hoa)."""
+    return (not status or row[3] == status) and (not text or text in row[4].upper())
+
+
+class ResultFilterProxy(QAbstractProxyModel):
+    """
+    Lọc ResultTableModel theo status / S/N. Việc quét toàn bộ dòng của ngày chạy trên thread
+    nền (đọc thẳng từ source, không qua cache của model); GUI thread chỉ nhận danh sách dòng
+    khớp. Dòng mới append vào model được kiểm tra ngay (O(1)/dòng).
+    """
+    _filtered = pyqtSignal(int, object, int)   # generation, dòng khớp, số dòng đã quét
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.status = ""
+        self.text = ""
+        self._rows = None    # None = không lọc (đi thẳng tới source); list = dòng source khớp (tăng dần)
+        self._generation = 0
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="HistoryFilter")
+        self._filtered.connect(self._apply_filtered)
+
+    def setSourceModel(self, model: ResultTableModel):
+        self.beginResetModel()
+        super().setSourceModel(model)
+        model.modelAboutToBeReset.connect(self.beginResetModel)
+        model.modelReset.connect(self._on_source_reset)
+        model.rowsAboutToBeInserted.connect(self._on_rows_about_to_be_inserted)
+        model.rowsInserted.connect(self._on_rows_inserted)
+        self.endResetModel()
+
+    @property
+    def active(self) -> bool:
+        return bool(self.status or self.text)
+
+    def set_filter(self, status: str = "", text: str = ""):
+        self.status = (status or "").strip().upper()
+        self.text = (text or "").strip().upper()
+        self.beginResetModel()
+        self._rows = [] if self.active else None   # rỗng tới khi thread nền quét xong
+        self.endResetModel()
+        self._refilter()
+
+    def _refilter(self):
+        self._generation += 1
+        if not self.active:
+            return
+        source, count, tail = self.sourceModel().snapshot()
+        self._pool.submit(self._scan, self._generation, source, count, tail, self.status, self.text)
+
+    def _scan(self, generation, source, count, tail, status, text):
+        matches, pos = [], 0
+        try:
+            while pos < count:
+                page = source.fetch(pos, min(HISTORY_SCAN_CHUNK, count - pos))
+                if not page:
+                    break
+                matches.extend(pos + i for i, row in enumerate(page) if history_row_matches(row, status, text))
+                pos += len(page)
+        except (OSError, sqlite3.Error) as e:
+            print("Error filtering history:", e)
+        matches.extend(count + i for i, row in enumerate(tail) if history_row_matches(row, status, text))
+        self._filtered.emit(generation, matches, count + len(tail))
+
+    def _apply_filtered(self, generation, matches, scanned):
+        if generation != self._generation:
+            return  # bộ lọc / ngày đã đổi trong lúc quét
+        model = self.sourceModel()
+        # Dòng được append trong lúc thread nền đang quét
+        for r in range(scanned, model.rowCount()):
+            if history_row_matches(model.row(r), self.status, self.text):
+                matches.append(r)
+        self.beginResetModel()
+        self._rows = matches
+        self.endResetModel()
+
+    def _on_source_reset(self):
+        self._rows = [] if self.active else None
+        self.endResetModel()
+        self._refilter()
+
+    def _on_rows_about_to_be_inserted(self, parent, first, last):
+        if self._rows is None:
+            self.beginInsertRows(QModelIndex(), first, last)
+
+    def _on_rows_inserted(self, parent, first, last):
+        if self._rows is None:
+            self.endInsertRows()
+            return
+        model = self.sourceModel()
+        for r in range(first, last + 1):
+            if history_row_matches(model.row(r), self.status, self.text):
+                n = len(self._rows)
+                self.beginInsertRows(QModelIndex(), n, n)
+                self._rows.append(r)
+                self.endInsertRows()
+
+    def shutdown(self):
+        self._generation += 1
+        self._pool.shutdown(wait=False)
+
+    # ---- QAbstractProxyModel ----
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid():
+            return QModelIndex()
+        r = proxy_index.row() if self._rows is None else self._rows[proxy_index.row()]
+        return self.sourceModel().index(r, proxy_index.column())
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid():
+            return QModelIndex()
+        if self._rows is None:
+            return self.index(source_index.row(), source_index.column())
+        i = bisect.bisect_left(self._rows, source_index.row())
+        if i < len(self._rows) and self._rows[i] == source_index.row():
+            return self.index(i, source_index.column())
+        return QModelIndex()
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < self.rowCount()) or not (0 <= column < self.columnCount()):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        return self.sourceModel().rowCount() if self._rows is None else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() or self.sourceModel() is None else self.sourceModel().columnCount()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            return self.sourceModel().headerData(section, orientation, role)
+        return None
+
+
+# =================== UI FRAME SCHEDULER ===================
+UI_FRAME_MS = 16   # ~1 khung hình 60 Hz
+
+
+class UiFrameScheduler:
+    """
+    Gom các thay đổi hiển thị theo key; mỗi khung (UI_FRAME_MS) gọi apply(state) 1 lần với
+    giá trị mới nhất của từng key. Trạng thái trung gian trong cùng khung (vd. START rồi OK
+    tới trong 1 lần đọc COM) bị bỏ qua khi vẽ — chỉ phần hiển thị, không phải dữ liệu.
+    """
+
+    def __init__(self, apply, parent=None, interval_ms: int = UI_FRAME_MS):
+        self._apply = apply
+        self._state = {}
+        self._timer = QTimer(parent)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.flush)
+
+    def set(self, key: str, value):
+        self._state[key] = value
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        if not self._state:
+            return
+        state, self._state = self._state, {}
+        self._apply(state)
+
 
 class MyWindow(QMainWindow):
     date_signal = pyqtSignal(str, str, str)
+    persist_error = pyqtSignal(str)   # PersistenceWorker (thread khác) -> GUI
 
     def __init__(self):
         super().__init__()
@@ -66,6 +2854,8 @@ class MyWindow(QMainWindow):
         self._data_dir = os.path.join(self._app_dir, "data")
 
         self._load_ui()
+        # 5 QLabel sc_1..sc_5 (stylesheet) -> 1 widget tự vẽ, cùng vị trí/chữ
+        self.sensor_array = SensorArrayWidget.replace_labels([getattr(self, f"sc_{i}") for i in range(1, 6)])
         self.setWindowTitle("FT Assy Charger Base")
         # Window icon (from bundled DEPV.ico)
         icon_file = resource_path("DEPV.ico")
@@ -74,46 +2864,88 @@ class MyWindow(QMainWindow):
         self.setFixedSize(1380, 670)
         self.center_window()
 
-        # init Table
-        self.data_table.setColumnCount(4)
-        self.data_table.setHorizontalHeaderLabels(["No.", "Time", "ADC Value", "Result"])
+        # init Table: QTableWidget data_table -> QTableView trên model (đọc result store theo trang)
+        self._setup_history_table()
 
         # Khởi tạo biến
         self.serial_connection = None
+        self.serial_reader = None  # SerialReader thread (đọc COM)
+        # Mở lại COM sau lỗi: single-shot timer + backoff, tránh vòng lỗi -> mở lại -> lỗi trên GUI thread
+        self._reconnect_delay = SERIAL_RECONNECT_MIN_MS
+        self._reconnect_timer = QTimer(self)
+        self._reconnect_timer.setSingleShot(True)
+        self._reconnect_timer.timeout.connect(self._retry_reconnect)
+        self.log_console = LogConsole(self.display)  # số dòng theo config "log lines"
+        self.ui_frame = UiFrameScheduler(self._apply_view, self)  # value/ADC/sensor/counter mỗi ~16 ms
+        self._view = {}   # trạng thái đang hiển thị, để chỉ set widget khi giá trị đổi
         self._saved_com_port = ""  # last COM saved in config.csv
-        self._rx_buffer = bytearray()  # serial RX buffer (non-blocking)
         self.last_state = "NONE"
         self.qr_image = None  # tránh lỗi khi in trước lúc tạo QR
-        self.counter_date = None  # mốc ngày hiện hành của counter
+        self.label_image = None  # QImage label cỡ in (gửi cho spooler) — vẽ khi cần, xem print_canvas()
+        self._label_matrix = None  # ma trận QR của label hiện tại
+        self._label_key = ("", "")  # (model, vendor) của label hiện tại
+        self.label_renderer = LabelRenderer()
+        self.label_prefetcher = LabelPrefetcher(self.label_renderer)
+        self.label_archiver = LabelArchiver(self._app_dir)
+        self.result_writer = DailyCsvWriter(self._data_dir)
+        self.result_db = None   # SqliteResultStore khi config "result store" = sqlite/both
+        self._result_store_mode = "csv"
+        migration = migrate_result_files(self._data_dir)
+
+        # Logic trạm (không phụ thuộc Qt) — MyWindow chỉ nhận event để hiển thị/lưu
+        self.engine = StationEngine()
+        self.engine.subscribe(self.on_engine_event)
+        self.config_store = ConfigStore(self._config_path)
 
         # Load config + counter (có auto-reset theo ngày)
         self.load_config()
+        self.counter_store = CounterStore(self._counter_path)
+        self._open_result_store()
         self.load_counter()
+        self._show_counters()
+        self._start_persistence()
+        self.show_history_day(self._today_str())
 
-        self.ok_count.setText(f"{self.ok_count_value:04d}")
-        self.ng_count.setText(f"{self.ng_count_value:04d}")
-        self.total_count.setText(f"{self.total_count_value:04d}")
-
-        # timer update time & COM read
+        # timer update time (COM được đọc bởi SerialReader thread) — chỉ còn cập nhật giờ
         timer = QTimer(self)
         timer.timeout.connect(self.update_time)
         timer.start(1000)
-
-        self.serial_timer = QTimer(self)
-        self.serial_timer.timeout.connect(self.read_from_com)
-        self.serial_timer.start(100)
+        # Ngày + mã năm/tháng/ngày chỉ đổi lúc nửa đêm -> 1 timer single-shot, hẹn lại mỗi ngày
+        self._shown_date = None
+        self._shown_codes = (None, None, None)
+        self._midnight_timer = QTimer(self)
+        self._midnight_timer.setSingleShot(True)
+        self._midnight_timer.setTimerType(Qt.PreciseTimer)  # CoarseTimer lệch tới 5% (~1 giờ/ngày)
+        self._midnight_timer.timeout.connect(self.update_date)
+        self.update_time()
+        self.update_date()
 
         # signals
         self.connect_button.clicked.connect(self.connect_com)
         self.comboBox_com_ports.currentIndexChanged.connect(self.update_serial_port)
         self.make_qr.clicked.connect(self.make_qr_code1)
         self.print_qr.clicked.connect(self.print_qr_code)
+        self.print_spooler = PrintSpooler(self._make_print_backend(), self, self.label_renderer)
+        self.print_spooler.job_status.connect(self.on_print_job_status)
+        self.print_spooler.start()
+        menu_print = self.menuBar().addMenu("Print")
+        menu_print.addAction("Reprint by S/N...", self.reprint_by_serial)
+        menu_print.addAction("Print latency", self.show_print_latency)
+        menu_history = self.menuBar().addMenu("History")
+        action = menu_history.addAction("Show table")
+        action.setCheckable(True)
+        action.toggled.connect(self.toggle_history_table)
+        menu_history.addAction("Show day...", self.ask_history_day)
+        menu_history.addAction("Filter...", self.ask_history_filter)
+        menu_history.addAction("Clear filter", lambda: self.history_proxy.set_filter())
         # self.actionManual.triggered.connect(self.show_manual_message)
         self.actionVer.triggered.connect(self.show_about_message)
         self.actionInfor.triggered.connect(self.show_infor_message)
 
         # ---- đồng bộ show_model với comboBox (model) ----
         self.show_model.setReadOnly(True)  # chỉ hiển thị, không cho sửa
+        self.dept.textChanged.connect(self.engine.set_vendor)
+        self.dept.textChanged.connect(self.prefetch_labels)
         self.comboBox.currentTextChanged.connect(self.on_combo_model_changed)
         self.on_combo_model_changed(self.comboBox.currentText())  # set giá trị ban đầu
         # ---- gửi model xuống COM khi bấm nút ----
@@ -126,7 +2958,8 @@ class MyWindow(QMainWindow):
 
         # init state
         self.reset_sensors()
-        self.display.setPlainText("")
+        self.display.setPlainText("")  # các dòng log còn trong LogConsole vẫn được giữ
+        self._log_migration(migration)
         self.status.setReadOnly(True)
         self.qr_print.setReadOnly(True)
         self.dept.setReadOnly(True)
@@ -155,69 +2988,24 @@ class MyWindow(QMainWindow):
         current_datetime = QDateTime.currentDateTime()
         time_str = current_datetime.toString("HH:mm:ss")
         self.label_time.setText(time_str)
-        date_str = current_datetime.toString("dd-MM-yyyy")
-        self.label_date.setText(date_str)
-
-        # Cập nhật năm
-        year = current_datetime.toString("yyyy")
-        year_mapping = {
-            "2025": "Y",
-            "2026": "L",
-            "2027": "P",
-        }
-        self.year_display = year_mapping.get(year, year)
-        self.nam.setText(self.year_display)
-
-        # Cập nhật tháng
-        month = current_datetime.toString("M")
-        month_mapping = {
-            "10": "A",
-            "11": "B",
-            "12": "C"
-        }
-        self.month_display = month_mapping.get(month, month)
-        self.thang.setText(self.month_display)
-
-        # Cập nhật ngày
-        day = current_datetime.toString("d")
-        day_mapping = {
-            "1": "1",
-            "2": "2",
-            "3": "3",
-            "4": "4",
-            "5": "5",
-            "6": "6",
-            "7": "7",
-            "8": "8",
-            "9": "9",
-            "10": "A",
-            "11": "B",
-            "12": "C",
-            "13": "D",
-            "14": "E",
-            "15": "F",
-            "16": "G",
-            "17": "H",
-            "18": "J",
-            "19": "K",
-            "20": "L",
-            "21": "M",
-            "22": "N",
-            "23": "P",
-            "24": "R",
-            "25": "S",
-            "26": "T",
-            "27": "V",
-            "28": "W",
-            "29": "X",
-            "30": "Y",
-            "31": "Z",
-        }
-        self.day_display = day_mapping.get(day, day)
-        self.ngay.setText(self.day_display)
+
+    def update_date(self):
+        """Lúc mở app và mỗi nửa đêm: ngày, mã năm/tháng/ngày, auto reset counter; rồi hẹn lần sau."""
+        today = date.today()
+        if today != self._shown_date:
+            self._shown_date = today
+            self.label_date.setText(today.strftime("%d-%m-%Y"))
+
+            # Cập nhật mã năm / tháng / ngày — chỉ label nào thực sự đổi
+            codes = DATE_CODE_CALENDAR.codes(today)
+            for widget, old, new in zip((self.nam, self.thang, self.ngay), self._shown_codes, codes):
+                if old != new:
+                    widget.setText(new)
+            self._shown_codes = codes
 
         # Kiểm tra sang ngày mới để auto reset counter
         self._daily_reset_if_needed(reason="clock")
+        self._midnight_timer.start(ms_until_midnight() + DATE_ROLLOVER_MARGIN_MS)
 
     # ================== COM PORT ==================
     def populate_com_ports(self):
@@ -232,21 +3020,39 @@ class MyWindow(QMainWindow):
             if idx != -1:
                 self.comboBox_com_ports.setCurrentIndex(idx)
 
+    def _open_serial(self, port: str):
+        """Mở cổng COM và khởi động SerialReader thread."""
+        self.serial_connection = serial.Serial(port, SERIAL_BAUDRATE, timeout=SERIAL_READ_TIMEOUT)
+        self.serial_reader = SerialReader(self.serial_connection, self)
+        self.serial_reader.line_received.connect(self.on_serial_line)
+        self.serial_reader.error.connect(self.on_serial_error)
+        self.serial_reader.start()
+
+    def _close_serial(self):
+        """Dừng SerialReader thread rồi đóng cổng COM (nếu đang mở)."""
+        if self.serial_reader is not None:
+            self.serial_reader.stop()
+            self.serial_reader = None
+        if self.serial_connection:
+            self.serial_connection.close()
+
     def connect_com(self):
         selected_port = self.comboBox_com_ports.currentText()
         if selected_port:
             if self.serial_connection and self.serial_connection.is_open:
-                self.serial_connection.close()
+                self._cancel_reconnect()
+                self._close_serial()
                 self.comboBox_com_ports.setEnabled(True)
                 self.status.setText(f"Disconnected from {selected_port}")
                 self.status.setStyleSheet("color: orange;")
                 self.set_model.setEnabled(False)   # <--- thêm
             else:
+                self._cancel_reconnect()
                 try:
-                    self.serial_connection = serial.Serial(selected_port, 115200, timeout=0)
+                    self._open_serial(selected_port)
                     self.save_config_value("COM Port", selected_port)
                     self.comboBox_com_ports.setEnabled(False)
-                    self.status.setText(f"Connected to {selected_port} - 115200")
+                    self.status.setText(f"Connected to {selected_port} - {SERIAL_BAUDRATE}")
                     self.status.setStyleSheet("color: green;")
                     self.set_model.setEnabled(True)    # <--- thêm
                 except serial.SerialException as e:
@@ -261,277 +3067,272 @@ class MyWindow(QMainWindow):
             self.save_config_value("COM Port", selected_port)
 
         if self.serial_connection and self.serial_connection.is_open:
-            self.serial_connection.close()
+            self._cancel_reconnect()
+            self._close_serial()
             self.status.setText("Disconnected from old port")
             self.status.setStyleSheet("color: orange;")
 
-    def reconnect_com(self):
-        if self.serial_connection:
-            self.serial_connection.close()
+    def reconnect_com(self) -> bool:
+        """Đóng rồi mở lại cổng COM đang chọn. Trả về True nếu mở được."""
+        self._close_serial()
         selected_port = self.comboBox_com_ports.currentText()
         if selected_port:
             try:
-                self.serial_connection = serial.Serial(selected_port, 115200, timeout=0)
+                self._open_serial(selected_port)
                 self.comboBox_com_ports.setEnabled(False)
                 self.status.setText(f"Reconnected to {selected_port}")
                 self.status.setStyleSheet("color: green;")
                 self.set_model.setEnabled(True)        # <--- thêm
+                return True
             except serial.SerialException:
                 self.comboBox_com_ports.setEnabled(True)
                 self.status.setText("Failed to reconnect")
                 self.status.setStyleSheet("color: red;")
                 self.set_model.setEnabled(False)       # <--- thêm
+        return False
 
-    # ================== SERIAL READ ==================
-    def read_from_com(self):
-        # Non-blocking serial read: đọc hết dữ liệu đang chờ, tự tách dòng theo "\n".
-        if not self.serial_connection or not self.serial_connection.is_open:
+    def _schedule_reconnect(self):
+        """Hẹn lần mở lại COM kế tiếp; mỗi lần lỗi liên tiếp thời gian chờ nhân đôi (tới trần)."""
+        if self._reconnect_timer.isActive():
             return
-        try:
-            n = self.serial_connection.in_waiting
-            if not n:
-                return
+        delay = self._reconnect_delay
+        self._reconnect_timer.start(delay)
+        self._reconnect_delay = min(delay * 2, SERIAL_RECONNECT_MAX_MS)
+        self.status.setText(f"Lỗi cổng COM - thử lại sau {delay / 1000:g}s")
+        self.status.setStyleSheet("color: red;")
 
-            data = self.serial_connection.read(n)
-            if not data:
-                return
+    def _retry_reconnect(self):
+        if not self.reconnect_com() and self.comboBox_com_ports.currentText():
+            self._schedule_reconnect()
 
-            self._rx_buffer.extend(data)
+    def _cancel_reconnect(self):
+        """Huỷ lần mở lại đang hẹn và đưa backoff về mức đầu (connect/disconnect tay)."""
+        self._reconnect_timer.stop()
+        self._reconnect_delay = SERIAL_RECONNECT_MIN_MS
 
-            # Tách từng dòng theo "\n" (tránh block UI)
-            while True:
-                idx = self._rx_buffer.find(b'\n')
-                if idx == -1:
-                    break
-                line_bytes = self._rx_buffer[:idx]
-                del self._rx_buffer[: idx + 1]
+    # ================== SERIAL READ ==================
+    def on_serial_line(self, line: str):
+        """Slot nhận từng dòng từ SerialReader (chạy trên GUI thread)."""
+        # Đọc được dữ liệu -> cổng đã ổn, lần lỗi sau bắt đầu lại từ backoff nhỏ nhất
+        self._reconnect_delay = SERIAL_RECONNECT_MIN_MS
+        self.append_limited_log(line)
+        self.process_line(line)
 
-                line = line_bytes.decode('utf-8', errors='ignore').strip()
-                if line:
-                    self.append_limited_log(line)
-                    self.process_line(line)
-
-        except serial.SerialException:
-            self.status.setText("Lỗi cổng COM")
-            self.status.setStyleSheet("color: red;")
-            self.reconnect_com()
+    def on_serial_error(self, message: str):
+        # Không mở lại ngay: nếu cổng mở được nhưng đọc lỗi, sẽ thành vòng lặp bận trên GUI thread
+        self._close_serial()
+        self._schedule_reconnect()
 
 
     # ================== PARSER & DAILY-RESET HELPERS ==================
-    def _extract_adc_payload(self, line: str):
-        """Tìm phần sau data= / Data: (case-insensitive) và trả về chuỗi '0,1,0,1,0' hoặc None."""
-        low = line.lower()
-        for token in ("data=", "data:"):
-            i = low.find(token)
-            if i != -1:
-                return line[i + len(token):].strip()
-        return None
-
-    def _apply_sensor_colors(self, values):
-        """
-        Ánh xạ 5 giá trị sang 5 QLabel sc_1..sc_5:
-        - '1' -> đỏ (NG)
-        - khác -> xanh (mặc định)
-        """
-        for i in range(1, 6):  # 1..5
-            label = getattr(self, f"sc_{i}")
-            if i <= len(values) and values[i-1].strip() == "1":
-                label.setStyleSheet(COLOR_RED)
-            else:
-                label.setStyleSheet(COLOR_BLUE)
-
     def _today_str(self):
         return datetime.now().strftime("%Y-%m-%d")
 
-    def _get_data_csv_date(self):
-        """Lấy ngày (YYYY-MM-DD) dựa vào mtime của data.csv; nếu không có file thì trả về hôm nay."""
-        try:
-            if os.path.exists(self._counter_path):
-                ts = os.path.getmtime(self._counter_path)
-                return datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
-        except Exception:
-            pass
-        return self._today_str()
-
     def _daily_reset_if_needed(self, reason="timer"):
-        """Nếu đã sang ngày mới so với self.counter_date thì reset counter về 0 và lưu lại."""
-        today = self._today_str()
-        if getattr(self, "counter_date", None) != today:
-            # Reset biến
-            self.ok_count_value = 0
-            self.ng_count_value = 0
-            self.total_count_value = 0
-
-            # Cập nhật UI
-            self.ok_count.setText("0000")
-            self.ng_count.setText("0000")
-            self.total_count.setText("0000")
-
-            # Lưu lại và cập nhật mốc ngày
-            self.save_counter()
-            self.counter_date = today
-
-            # Log nhẹ để biết đã reset
-            self.append_limited_log(f"[Auto-reset counters for new day ({reason})]")
+        """Nếu đã sang ngày mới so với counter_date thì engine reset counter (xem on_engine_event)."""
+        self.engine.check_day(reason)
+
+    def _log_migration(self, summary):
+        if summary and summary["upgraded"]:
+            self.append_limited_log(
+                f"[Migrated {len(summary['upgraded'])} result file(s) to schema v{RESULT_SCHEMA_VERSION}]")
+        for path, err in (summary or {}).get("failed", {}).items():
+            self.append_limited_log(f"[Migration failed: {os.path.basename(path)}: {err}]")
+
+    def _show_counters(self):
+        self.ui_frame.set("counters", (self.engine.ok_count, self.engine.ng_count, self.engine.total_count))
+
+    def _apply_view(self, state: dict):
+        """Áp trạng thái mới nhất của khung lên widget; bỏ qua giá trị không đổi."""
+        shown = self._view
+        if "value" in state and state["value"] != shown.get("value"):
+            text, style = state["value"]
+            old_text, old_style = shown.get("value", (None, None))
+            if text != old_text:
+                self.value.setText(text)
+            if style != old_style:
+                self.value.setStyleSheet(style)
+        if "adc" in state and state["adc"] != shown.get("adc"):
+            self.value_adc.setText(state["adc"])
+        if "sensors" in state:
+            self.sensor_array.set_mask(state["sensors"])
+        if "counters" in state and state["counters"] != shown.get("counters"):
+            ok, ng, total = state["counters"]
+            self.ok_count.setText(f"{ok:04d}")
+            self.ng_count.setText(f"{ng:04d}")
+            self.total_count.setText(f"{total:04d}")
+        shown.update(state)
 
     # ================== PROCESS LINE ==================
     def process_line(self, line):
-        s = line.strip()
-        up = s.upper()
-
-        # START -> reset 5 QLabel
-        if up.startswith("START"):
-            self.reset_sensors()
-            self.value.setText("Test..")
-            self.value.setStyleSheet(COLOR_WAIT)
+        self.engine.feed_line(line)
+
+    def on_engine_event(self, event):
+        """Subscriber của StationEngine: cập nhật widget, tạo/in QR và lưu kết quả."""
+        if isinstance(event, StateEvent):
+            if event.state == "START" and date.today() != self._shown_date:
+                # Phòng khi timer nửa đêm bị trễ (máy sleep, đổi giờ hệ thống)
+                self.update_date()
+            # Fixture đang test -> vẽ trước label kế tiếp
+            self.prefetch_labels()
+            # START -> "Test..", WAITING -> "Wait"; cả hai reset đèn sensor
+            self.ui_frame.set("sensors", 0)
+            self.ui_frame.set("value", ("Test.." if event.state == "START" else "Wait", COLOR_WAIT))
             return
 
-        # Waiting
-        if up.startswith("WAITING"):
-            self.value.setText("Wait")
-            self.value.setStyleSheet(COLOR_WAIT)
-            self.reset_sensors()
+        if isinstance(event, CounterResetEvent):
+            self.prefetch_labels()  # sang ngày mới -> mã ngày trong S/N đổi
+            self.show_history_day(event.date)
+            self._show_counters()
+            self.save_counter()
+            # Log nhẹ để biết đã reset
+            self.append_limited_log(f"[Auto-reset counters for new day ({event.reason})]")
             return
 
-        # Lấy payload ADC nếu có (hỗ trợ 'data=' hoặc 'Data:')
-        adc_str = self._extract_adc_payload(s)
+        if not isinstance(event, ResultEvent):
+            return
 
-        # OK
-        if up.startswith("OK"):
-            self.value.setText("OK")
-            self.value.setStyleSheet(COLOR_OK)
-            self.reset_sensors()
-
-            # hiển thị ADC nếu có
-            if adc_str is not None:
-                self.value_adc.setText(adc_str)
-
-            # cập nhật bộ đếm
-            self.ok_count_value += 1
-            self.ok_count.setText(f"{self.ok_count_value:04d}")
-            self.total_count_value = self.ok_count_value + self.ng_count_value
-            self.total_count.setText(f"{self.total_count_value:04d}")
-
-            # QR & lưu
-            self.make_qr_code1()
+        # Hiển thị: gom theo khung hình; lưu kết quả (bên dưới) thì luôn làm cho mọi event
+        self.ui_frame.set("value", (event.status, COLOR_OK if event.is_ok else COLOR_NG))
+        self.ui_frame.set("adc", event.adc)
+        # tô màu theo giá trị sensor (1 -> đỏ), OK thì tắt hết
+        mask = self.sensor_array.mask_for(event.sensors) if not event.is_ok and event.sensors else 0
+        self.ui_frame.set("sensors", mask)
+        self._show_counters()
+
+        if event.is_ok:
+            # QR & in
+            self.make_qr_code1(event.serial_no)
             self.print_qr_code()
-            self.save_qlineedit_to_csv()
-            self.save_counter()
+            self.prefetch_labels()
+        self.save_qlineedit_to_csv(event)
+        self.save_counter()
+        self._append_history(event)
+
+    def append_limited_log(self, text_line):
+        self.log_console.append(text_line)
+
+    # ================== HISTORY TABLE ==================
+    def _setup_history_table(self):
+        """Thay QTableWidget data_table (.ui) bằng QTableView cùng vị trí/font/style."""
+        old = self.data_table
+        view = QTableView(old.parentWidget())
+        view.setGeometry(old.geometry())
+        view.setFont(old.font())
+        view.setStyleSheet(old.styleSheet())
+        old.hide()
+        old.deleteLater()
+
+        self.history_model = ResultTableModel(self)
+        self._csv_history_sources = OrderedDict()   # path -> CsvHistorySource (giữ chỉ mục dòng)
+        self.history_proxy = ResultFilterProxy(self)
+        self.history_proxy.setSourceModel(self.history_model)
+        view.setModel(self.history_proxy)
+        view.verticalHeader().hide()
+        # Chiều cao dòng cố định -> view không phải đo từng dòng khi cuộn
+        view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        view.verticalHeader().setDefaultSectionSize(view.fontMetrics().height() + 6)
+        for col, width in enumerate((45, 90, 100, 60)):
+            view.horizontalHeader().resizeSection(col, width)
+        view.horizontalHeader().setStretchLastSection(True)  # S/N
+        view.setSelectionBehavior(QTableView.SelectRows)
+        view.setWordWrap(False)
+        view.show()
+        self.data_table = view
+
+    def show_history_day(self, day: str):
+        """Hiển thị kết quả của 1 ngày ('YYYY-MM-DD') từ result store đang dùng."""
+        if self.result_db is not None:
+            source = SqliteHistorySource(self.result_db, day)
+        else:
+            # Dùng lại source (và chỉ mục dòng) của ngày đã xem: count() chỉ đọc phần mới ghi thêm
+            path = self.result_writer.path_for(day)
+            source = self._csv_history_sources.pop(path, None) or CsvHistorySource(path)
+            self._csv_history_sources[path] = source
+            while len(self._csv_history_sources) > HISTORY_CSV_SOURCES:
+                self._csv_history_sources.popitem(last=False)
+        self.history_model.set_source(source, day)
+        self.data_table.scrollToBottom()
+
+    def _append_history(self, event: ResultEvent):
+        if self.history_model.day != event.timestamp.strftime("%Y-%m-%d"):
+            return  # đang xem ngày khác
+        bar = self.data_table.verticalScrollBar()
+        at_end = bar.value() == bar.maximum()
+        self.history_model.append(history_row(event, self.history_model.next_no()))
+        if at_end:
+            self.data_table.scrollToBottom()
+
+    def toggle_history_table(self, visible: bool):
+        """Menu History > Show table: mở rộng cửa sổ xuống để thấy bảng (nằm dưới vùng 670 px)."""
+        height = 670
+        if visible:
+            height = max(height, self.data_table.geometry().bottom() + self.menuBar().height()
+                         + self.statusbar.height() + 10)
+        self.setFixedSize(1380, height)
+
+    def ask_history_day(self):
+        day, ok = QInputDialog.getText(self, "History", "Ngày (YYYY-MM-DD):", text=self.history_model.day)
+        day = day.strip()
+        if not ok or not day:
             return
-
-        # NG
-        if up.startswith("NG"):
-            self.value.setText("NG")
-            self.value.setStyleSheet(COLOR_NG)
-
-            # reset trước rồi tô lại theo payload
-            self.reset_sensors()
-
-            if adc_str is not None:
-                self.value_adc.setText(adc_str)
-                values = [v.strip() for v in adc_str.split(",") if v.strip() != ""]
-                # tô màu theo 5 giá trị (1 -> đỏ)
-                self._apply_sensor_colors(values)
-
-            # cập nhật bộ đếm
-            self.ng_count_value += 1
-            self.ng_count.setText(f"{self.ng_count_value:04d}")
-            self.total_count_value = self.ok_count_value + self.ng_count_value
-            self.total_count.setText(f"{self.total_count_value:04d}")
-
-            self.save_qlineedit_to_csv()
-            self.save_counter()
+        try:
+            datetime.strptime(day, "%Y-%m-%d")
+        except ValueError:
+            QMessageBox.warning(self, "History", f"Ngày không hợp lệ: {day}")
             return
+        self.show_history_day(day)
 
-        # (Tuỳ chọn) các dòng khác: không làm gì
-
-    def append_limited_log(self, text_line, max_lines=20):
-        cursor = self.display.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        cursor.insertText(text_line + '\n')
-        lines = self.display.toPlainText().splitlines()
-        if len(lines) > max_lines:
-            self.display.clear()
-            self.display.appendPlainText('\n'.join(lines[-max_lines:]))
-        self.display.moveCursor(QTextCursor.End)
+    def ask_history_filter(self):
+        text, ok = QInputDialog.getText(self, "Filter", "OK / NG / S/N (một phần):", text=self.history_proxy.text)
+        if not ok:
+            return
+        text = text.strip()
+        if text.upper() in ("OK", "NG"):
+            self.history_proxy.set_filter(status=text)
+        else:
+            self.history_proxy.set_filter(text=text)
 
     # ================== QR CODE ==================
     
 
-    def make_qr_code1(self):
+    def make_qr_code1(self, qr_data=None):
         # ==== Lấy dữ liệu tạo QR ====
-        year  = self.year_display
-        month = self.month_display
-        day   = self.day_display
-
-        data3 = self.dept.text()
-        data4 = self.company.text()   # (đang không dùng trong chuỗi, nhưng giữ lại nếu cần)
-        additional_text = self.comboBox.currentText()
-        counter_str = f"{self.ok_count_value:04d}"
-
-        # Chuỗi QR giữ nguyên định dạng cũ
-        qr_data = "".join(["18", additional_text, data3, year[-1], month, day, counter_str])
+        # Nút make_qr (không có S/N truyền vào) -> tạo lại theo counter hiện tại
+        if not isinstance(qr_data, str):
+            qr_data = self.engine.serial_no_for(self.engine.ok_count)
+        additional_text = self.engine.model
         self.qr_print.setText(qr_data)
 
-        # ==== Tham số bố cục có thể chỉnh nhanh ====
-        QR_SIDE      = 300           # Kích thước QR vuông (px) — có thể đổi 236/280/320...
-        PADDING      = 12            # Lề xung quanh
-        TEXT_AREA_H  = 72            # Vùng dành cho chữ (2 dòng)
-        CANVAS_W     = QR_SIDE + 2*PADDING
-        CANVAS_H     = QR_SIDE + 2*PADDING + TEXT_AREA_H
-
-        FONT_MAIN_SZ = 20            # size chữ dòng 1 (additional_text)
-        FONT_SUB_SZ  = 14            # size chữ dòng 2 (qr_data)
-
-        # ==== Tạo ảnh QR (PIL) ====
-        qr = qrcode.QRCode(version=1, box_size=12, border=2)
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        qr_pil_image = qr.make_image(fill_color="black", back_color="white")
-        qr_pil_image = qr_pil_image.resize((QR_SIDE, QR_SIDE), resample=Image.NEAREST)  # Giữ cạnh sắc nét cho QR
-        # Chuyển PIL -> QImage nhanh (không cần PIL.ImageQt)
-        qr_qimage = pil_to_qimage(qr_pil_image)
-        # ==== Vẽ canvas tổng hợp ====
-        canvas = QPixmap(CANVAS_W, CANVAS_H)
-        canvas.fill(Qt.white)
-        painter = QPainter(canvas)
-
-        # Vẽ QR (căn giữa theo chiều ngang)
-        qr_x = (CANVAS_W - QR_SIDE) // 2
-        qr_y = PADDING
-        painter.drawImage(qr_x, qr_y, qr_qimage)
-
-        # Vẽ 2 dòng chữ bên dưới
-        painter.setPen(Qt.black)
-
-        # Dòng 1: additional_text
-        font1 = QFont("SamsungSharpSans-Bold", FONT_MAIN_SZ)
-        painter.setFont(font1)
-        fm1 = painter.fontMetrics()
-        text1 = fm1.elidedText(additional_text, Qt.ElideRight, CANVAS_W - 2*PADDING)
-        text1_w = fm1.horizontalAdvance(text1)
-        text1_x = (CANVAS_W - text1_w) // 2
-        text1_baseline_y = qr_y + QR_SIDE + PADDING + fm1.ascent()
-        painter.drawText(text1_x, text1_baseline_y, text1)
+        # ==== Lấy QR đã mã hoá trước (kèm label cỡ in nếu có), nếu chưa có thì mã hoá ngay ====
+        vendor = self.engine.vendor
+        prepared = self.label_prefetcher.take(qr_data, additional_text, vendor)
+        if prepared is None:
+            prepared = (self.label_renderer.encode(qr_data), None)
+        self._label_matrix, self.label_image = prepared
+        self._label_key = (additional_text, vendor)
+
+        # ==== Hiển thị: vẽ thẳng ở cỡ label_qr_code, không scale label cỡ in ====
+        preview = self.label_renderer.render_preview(
+            self._label_matrix, additional_text, vendor, self.label_qr_code.width(), self.label_qr_code.height()
+        )
+        self.qr_image = QPixmap.fromImage(preview)
+        self.label_qr_code.setPixmap(self.qr_image)
 
-        # # Dòng 2: qr_data (nhỏ hơn, nằm dưới dòng 1)
-        # font2 = QFont("SamsungSharpSans-Bold", FONT_SUB_SZ)
-        # painter.setFont(font2)
-        # fm2 = painter.fontMetrics()
-        # text2 = fm2.elidedText(qr_data, Qt.ElideRight, CANVAS_W - 2*PADDING)
-        # text2_w = fm2.horizontalAdvance(text2)
-        # text2_x = (CANVAS_W - text2_w) // 2
-        # text2_baseline_y = text1_baseline_y + fm2.height() + 2  # khoảng cách 2px
-        # painter.drawText(text2_x, text2_baseline_y, text2)
+        # ==== Lưu (thread nền, theo config "label archive") ====
+        if self.label_archiver.mode != "off":
+            self.label_archiver.submit(self.print_canvas(), qr_data, self._today_str())
 
-        painter.end()
+    def print_canvas(self) -> QImage:
+        """Label cỡ in của QR hiện tại — chỉ vẽ khi có in/lưu ảnh cần tới."""
+        if self.label_image is None and self._label_matrix is not None:
+            self.label_image = self.label_renderer.render_matrix(self._label_matrix, *self._label_key)
+        return self.label_image
 
-        # ==== Lưu & hiển thị ====
-        canvas.save(os.path.join(self._app_dir, "qr_code.png"))
-        self.qr_image = canvas
-        self.label_qr_code.setPixmap(
-            canvas.scaled(self.label_qr_code.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        )
+    def _needs_print_canvas(self) -> bool:
+        """Có cần label cỡ in không (in qua QPrinter hoặc lưu ảnh label)."""
+        printing = not self.enable_print.isChecked() and self.print_spooler.backend.needs_image
+        return printing or self.label_archiver.mode != "off"
 
     
     def print_qr_code(self):
@@ -539,218 +3340,237 @@ class MyWindow(QMainWindow):
         if self.enable_print.isChecked():
             return
         if self.qr_image:
-            printer = QPrinter(QPrinter.HighResolution)
-            painter = QPainter(printer)
-            rect = painter.viewport()
-            size = self.qr_image.size()
-            size.scale(rect.size(), Qt.KeepAspectRatio)
-            painter.setViewport(rect.x(), rect.y(), size.width(), size.height())
-            painter.setWindow(self.qr_image.rect())
-            painter.drawPixmap(0, 0, self.qr_image)
-            painter.end()
-
-    # ================== SAVE ==================
-    def save_qlineedit_to_csv(self):
-        read_adc = self.value_adc.text().strip()   # Giá trị ADC
-        status   = self.value.text().strip()       # Trạng thái OK/NG
+            # Đưa vào spooler (thread riêng) — không chờ driver máy in; ZPL/TSPL không cần ảnh
+            image = self.print_canvas() if self.print_spooler.backend.needs_image else None
+            self.print_spooler.submit(image, self.qr_print.text(), self.engine.model, self.engine.vendor)
 
-        # Lấy chuỗi QR đang hiển thị
+    def _make_print_backend(self):
+        cfg = self.config_store.config
         try:
-            qr_str = self.qr_print.text().strip()
-        except AttributeError:
-            qr_str = self.qr_print.toPlainText().strip()
-
-        os.makedirs(self._data_dir, exist_ok=True)
-        save_path = os.path.join(self._data_dir, f"adc_data_{datetime.now().strftime('%Y-%m-%d')}.csv")
-
-        header_new = ["No.", "Date", "Time", "ADC Value", "Status", "S/N"]
-
-
-        required_header = [h.lower() for h in header_new]
-
-        def _file_date_from_name(path: str) -> str:
-            # data/adc_data_YYYY-MM-DD.csv
-            m = re.search(r"adc_data_(\d{4}-\d{2}-\d{2})\.csv$", os.path.basename(path))
-            return m.group(1) if m else datetime.now().strftime("%Y-%m-%d")
-
-        # --- Nâng cấp header nếu file đã tồn tại nhưng thiếu/khác cột
-        if os.path.exists(save_path):
-            try:
-                with open(save_path, 'r', encoding='utf-8', newline='') as rf:
-                    reader = csv.reader(rf)
-                    cur_header = next(reader, [])
-                    cur_norm = [c.strip().lower() for c in cur_header]
-
-                    # Chỉ nâng cấp khi header khác với chuẩn
-                    if cur_norm != required_header:
-                        old_rows = list(reader)
-                    else:
-                        old_rows = None
-
-                if old_rows is not None:
-                    file_date = _file_date_from_name(save_path)
-                    tmp_path = save_path + '.tmp'
-                    with open(tmp_path, 'w', encoding='utf-8', newline='') as wf:
-                        writer = csv.writer(wf)
-                        writer.writerow(header_new)
-
-                        for row in old_rows:
-                            if not row:
-                                continue
-
-                            # Các format phổ biến:
-                            # - cũ (4 cột): No, Time, ADC Value, Result
-                            # - mới thiếu S/N (5 cột): No, Date, Time, ADC Value, Status
-                            if len(row) == 4:
-                                new_row = [row[0], file_date, row[1], row[2], row[3], '']
-                            elif len(row) == 5:
-                                new_row = row + ['']
-                            else:
-                                # Không rõ format: pad/trim về 6 cột
-                                new_row = (row + [''] * 6)[:6]
-
-                            writer.writerow(new_row)
-
-                    os.replace(tmp_path, save_path)
-
-            except Exception:
-                # Nếu nâng cấp thất bại, bỏ qua để vẫn có thể ghi bản ghi mới
-                pass
+            return make_print_backend(cfg.print_backend, cfg.printer_target)
+        except (ValueError, OSError) as e:
+            print("Error creating print backend:", e)
+            return QtPrintBackend()
+
+    def reprint_by_serial(self):
+        """Menu Print > Reprint by S/N...: in lại label của 1 S/N đã in gần đây."""
+        serial_no, ok = QInputDialog.getText(self, "Reprint", "S/N:", text=self.qr_print.text())
+        serial_no = serial_no.strip()
+        if not ok or not serial_no:
+            return
+        if self.print_spooler.reprint(serial_no) is None:
+            QMessageBox.warning(self, "Reprint", f"Không tìm thấy label của {serial_no} trong lịch sử in.")
+
+    def show_print_latency(self):
+        """Menu Print > Print latency: thời gian gửi job gần đây (ms)."""
+        st = self.print_spooler.latency_stats()
+        QMessageBox.information(
+            self, "Print latency",
+            f"Backend: {self.print_spooler.backend.name}\n"
+            f"Jobs sent: {st['count']}\n"
+            f"Last: {st['last']:.1f} ms\nAverage: {st['avg']:.1f} ms\nMax: {st['max']:.1f} ms",
+        )
 
+    def on_print_job_status(self, job_id: int, serial_no: str, status: str, error: str, latency_ms: float):
+        msg = f"Print #{job_id} {serial_no}: {status}"
+        if status != JOB_QUEUED:
+            msg += f" {latency_ms:.0f} ms"
+        if error:
+            msg += f" ({error})"
+        self.statusbar.showMessage(msg, 10000)
+        if status == JOB_FAILED:
+            self.append_limited_log(f"[{msg}]")
 
-        # --- Đếm số dòng để xác định No.
-        file_exists = os.path.exists(save_path)
-        row_count = 0
-        if file_exists:
-            try:
-                with open(save_path, 'r', encoding='utf-8') as cf:
-                    row_count = sum(1 for _ in cf) - 1  # trừ header
-                    if row_count < 0:
-                        row_count = 0
-            except Exception:
-                row_count = 0
-
-        # --- Ghi dữ liệu
+    # ================== SAVE ==================
+    def _open_result_store(self):
+        """Mở SQLite result store nếu config chọn sqlite/both (commit theo lô, timer giới hạn độ trễ)."""
+        if self._result_store_mode not in ("sqlite", "both"):
+            return
         try:
-            write_header = (not file_exists) or (os.path.getsize(save_path) == 0)
-            with open(save_path, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                if write_header:
-                    writer.writerow(header_new)
-                current_date = datetime.now().strftime("%Y-%m-%d")
-                current_time = datetime.now().strftime("%H:%M:%S")
-                writer.writerow([row_count + 1, current_date, current_time, read_adc, status, qr_str])
-        except Exception as e:
-            QMessageBox.critical(self, "Lỗi", f"Không thể lưu dữ liệu: {str(e)}")
+            self.result_db = SqliteResultStore(os.path.join(self._data_dir, RESULT_DB_FILE))
+        except sqlite3.Error as e:
+            print("Error opening result db:", e)
+            self._result_store_mode = "csv"
+            return
+
+    def _start_persistence(self):
+        """Khởi động PersistenceWorker; lưu lại các kết quả còn trong journal (crash lần trước)."""
+        self.persist_error.connect(self.on_persist_error)
+        journal = ResultJournal(os.path.join(self._data_dir, JOURNAL_FILE))
+        idle = self.result_db.max_delay / 2 if self.result_db is not None else 0.5
+        self.persistence = PersistenceWorker(
+            self._persist_result, journal,
+            flush=self._flush_result_stores,
+            on_error=self.persist_error.emit,
+            idle_interval=idle,
+        )
+        recovered = journal.pending()
+        self.persistence.start()
+        for result in recovered:
+            self.persistence.submit(result)
+        if recovered:
+            self.append_limited_log(f"[Recovered {len(recovered)} unsaved result(s) from journal]")
+            today = [r for r in recovered if r.timestamp.strftime("%Y-%m-%d") == self.engine.counter_date]
+            if today:
+                ok = max(self.engine.ok_count, max(r.ok_count for r in today))
+                ng = max(self.engine.ng_count, max(r.ng_count for r in today))
+                if (ok, ng) != (self.engine.ok_count, self.engine.ng_count):
+                    self.engine.set_counters(ok, ng, ok + ng, self.engine.counter_date)
+                    self._show_counters()
+                    self.save_counter()
+
+    def save_qlineedit_to_csv(self, result: ResultEvent):
+        """Đưa kết quả vào hàng đợi lưu (write-behind) — trả về ngay, không chờ đĩa."""
+        self.persistence.submit(result)
+
+    def _persist_result(self, result: ResultEvent):
+        """
+        Chạy trên PersistenceWorker. Lưu theo config "result store": csv -> data/adc_data_YYYY-MM-DD.csv
+        (append, No. giữ trong RAM), sqlite -> data/results.db, both -> cả hai.
+        """
+        if self._result_store_mode != "sqlite":
+            self.result_writer.write(result)
+        if self.result_db is not None:
+            self.result_db.write(result)
+
+    def _flush_result_stores(self) -> bool:
+        """Chạy trên PersistenceWorker khi rảnh: True nếu mọi kết quả đã xuống đĩa."""
+        self.result_writer.sync()
+        if self.result_db is not None:
+            self.result_db.flush_if_due()
+            return not self.result_db.pending  # lô SQLite chưa commit -> chưa cắt journal
+        return True
+
+    def on_persist_error(self, message: str):
+        QMessageBox.critical(self, "Lỗi", f"Không thể lưu dữ liệu: {message}")
 
     # ================== RESET ==================
     def reset_sensors(self):
-        for i in range(1, 6):  # 1..5
-            label = getattr(self, f"sc_{i}")
-            label.setStyleSheet(COLOR_BLUE)
+        self.sensor_array.set_mask(0)
 
     # ================== COUNTER + CONFIG ==================
 
     def save_config_value(self, key_name: str, value: str):
         """
-        Update/append 1 key-value into config.csv (2 columns).
+        Update/append 1 key-value vào config (RAM) — ConfigStore ghi config.csv sau (debounce, atomic).
         Giữ lại các key khác (nếu có).
         """
-        try:
-            rows = []
-            found = False
-            if os.path.exists(self._config_path):
-                with open(self._config_path, "r", encoding="utf-8", newline="") as f:
-                    reader = csv.reader(f)
-                    for row in reader:
-                        if not row or len(row) < 2:
-                            continue
-                        k = row[0].strip()
-                        v = row[1].strip()
-                        if k.lower() == key_name.strip().lower():
-                            rows.append([k, value])
-                            found = True
-                        else:
-                            rows.append([k, v])
-
-            if not found:
-                rows.append([key_name, value])
-
-            with open(self._config_path, "w", encoding="utf-8", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerows(rows)
-        except Exception as e:
-            print("Error saving config:", e)
+        self.config_store.set(key_name, value)
 
     def load_config(self):
         try:
-            with open(self._config_path, 'r', encoding='utf-8', newline='') as file:
-                reader = csv.reader(file)
-                for row in reader:
-                    if len(row) < 2:
-                        continue
-                    key = row[0].strip().lower()
-                    val = row[1].strip()
-                    if key == "name":
-                        self.name.setText(val)
-                    elif key == "vendor code":
-                        self.dept.setText(val)
-                    elif key == "part code":
-                        self.company.setText(val)
-                    elif key == "com port":
-                        self._saved_com_port = val
+            cfg = self.config_store.load()
         except Exception as e:
             print("Error reading config:", e)
+            cfg = self.config_store.config
+        self._apply_config(cfg)
+        self._result_store_mode = cfg.result_store
 
-    def load_counter(self):
-        today = self._today_str()
-        file_date = self._get_data_csv_date()
+        if cfg.hot_reload:
+            self._config_watcher = QFileSystemWatcher(self)
+            self._config_watcher.fileChanged.connect(self.on_config_file_changed)
+            self._config_watcher.directoryChanged.connect(self.on_config_dir_changed)
+            self._watch_config_file()
 
-        if file_date != today:
-            # File counter thuộc ngày cũ -> reset
-            self.ok_count_value = self.ng_count_value = self.total_count_value = 0
-            self.counter_date = today
-            self.save_counter()   # cập nhật mtime sang hôm nay + lưu 0000
-            return
+    def _watch_config_file(self):
+        """
+        Theo dõi config.csv; khi file chưa có (máy mới — file chỉ xuất hiện ở lần flush đầu)
+        hoặc vừa bị thay thế thì theo dõi thư mục chứa nó cho tới khi file xuất hiện.
+        """
+        watcher = self._config_watcher
+        folder = os.path.dirname(os.path.abspath(self._config_path))
+        if os.path.exists(self._config_path):
+            if self._config_path not in watcher.files():
+                watcher.addPath(self._config_path)
+            if folder in watcher.directories():
+                watcher.removePath(folder)
+        elif folder not in watcher.directories():
+            watcher.addPath(folder)
+
+    def _apply_config(self, cfg: StationConfig):
+        self.name.setText(cfg.name)
+        self.dept.setText(cfg.vendor_code)
+        self.engine.set_vendor(cfg.vendor_code)
+        self.company.setText(cfg.part_code)
+        self._saved_com_port = cfg.com_port
+        self.label_archiver.set_mode(cfg.label_archive)
+        self.log_console.set_max_lines(cfg.log_lines)
+
+    def on_config_dir_changed(self, path: str):
+        if os.path.exists(self._config_path):
+            self.on_config_file_changed(self._config_path)
+
+    def on_config_file_changed(self, path: str):
+        """config.csv bị sửa ngoài chương trình -> đọc lại (bỏ qua nếu là lần ghi của chính mình)."""
+        # Ghi atomic (os.replace) làm watcher mất file -> đăng ký lại
+        self._watch_config_file()
+        old = self.config_store.config
+        if self.config_store.reload():
+            cfg = self.config_store.config
+            self._apply_config(cfg)
+            self.append_limited_log("[config.csv reloaded]")
+            restart = [key for key in CONFIG_RESTART_KEYS
+                       if getattr(old, CONFIG_KEYS[key]) != getattr(cfg, CONFIG_KEYS[key])]
+            if restart:
+                self.append_limited_log(f"[{', '.join(restart)}: khởi động lại để áp dụng]")
 
-        # Ngày trùng hôm nay -> đọc giá trị cũ nếu có
-        if os.path.exists(self._counter_path):
-            try:
-                with open(self._counter_path, "r", newline='') as f:
-                    reader = csv.reader(f)
-                    for row in reader:
-                        if row[0] == "OK":
-                            self.ok_count_value = int(row[1])
-                        elif row[0] == "NG":
-                            self.ng_count_value = int(row[1])
-                        elif row[0] == "Total":
-                            self.total_count_value = int(row[1])
-            except Exception:
-                self.ok_count_value = self.ng_count_value = self.total_count_value = 0
+    def load_counter(self):
+        """
+        Đọc counter từ data.csv (reset nếu thuộc ngày cũ) rồi đối chiếu với log kết quả của
+        hôm nay: nếu data.csv mất/hỏng hoặc chưa kịp ghi trước khi crash thì lấy theo log.
+        """
+        today = self._today_str()
+        stored = self.counter_store.load()
+        if stored is not None and stored[3] == today:
+            ok, ng, total = stored[:3]
         else:
-            self.ok_count_value = self.ng_count_value = self.total_count_value = 0
+            # Không có file / file hỏng / file counter thuộc ngày cũ -> 0
+            ok = ng = total = 0
+
+        log_ok, log_ng = self._count_logged_results(today)
+        if log_ok > ok or log_ng > ng:
+            ok, ng = max(ok, log_ok), max(ng, log_ng)
+            total = ok + ng
 
         # Ghi nhận mốc ngày dùng để so sánh trong lúc chạy
-        self.counter_date = today
+        self.engine.set_counters(ok, ng, total, today)
+        if stored is None or stored[:3] != (ok, ng, total) or stored[3] != today:
+            self.save_counter()
 
-    def save_counter(self):
-        """
-        Lưu giá trị counter vào file data.csv
-        Format:
-            OK,xxxx
-            NG,xxxx
-            Total,xxxx
-        """
+    def _count_logged_results(self, day: str):
+        """(OK, NG) đã lưu trong ngày theo result store đang dùng."""
         try:
-            with open(self._counter_path, "w", newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(["OK", f"{self.ok_count_value:04d}"])
-                writer.writerow(["NG", f"{self.ng_count_value:04d}"])
-                writer.writerow(["Total", f"{self.total_count_value:04d}"])
+            if self.result_db is not None:
+                counts = self.result_db.count_by_status(day)
+                return counts.get("OK", 0), counts.get("NG", 0)
+            return count_results_in_csv(self.result_writer.path_for(day))
         except Exception as e:
-            print("Error saving counter:", e)
+            print("Error counting results:", e)
+            return 0, 0
+
+    def save_counter(self):
+        """Lưu counter (CounterStore gom các lần ghi liên tiếp, ghi atomic trên thread riêng)."""
+        self.counter_store.save(self.engine.ok_count, self.engine.ng_count,
+                                self.engine.total_count, self.engine.counter_date)
 
     # ================== OTHER ==================
+    def closeEvent(self, event):
+        self._reconnect_timer.stop()
+        self._close_serial()
+        self.print_spooler.stop()
+        self.label_prefetcher.shutdown()
+        self.label_archiver.shutdown()
+        self.history_proxy.shutdown()
+        # Lưu hết hàng đợi trước khi đóng file/DB
+        self.persistence.stop()
+        self.result_writer.close()
+        self.counter_store.close()
+        self.config_store.close()
+        if self.result_db is not None:
+            self.result_db.close()
+        self.persistence.journal.close()
+        super().closeEvent(event)
+
     def center_window(self):
         screen = QDesktopWidget().screenGeometry()
         x = (screen.width() - self.width()) // 2
@@ -767,8 +3587,25 @@ class MyWindow(QMainWindow):
     def show_infor_message(self):
         QMessageBox.information(self, "Contact PIC", "songhung.tr\nVC/RD-Stick Team\nMobi: 03750311**")
 
+    def prefetch_labels(self, *_):
+        """Bỏ label đã vẽ trước nếu model/vendor/ngày đã đổi, rồi đặt vẽ N label kế tiếp."""
+        model, vendor = self.engine.model, self.engine.vendor
+        key = (model, vendor, self.engine.serial_no_for(0))
+        if key != getattr(self, "_prefetch_key", None):
+            self.label_prefetcher.invalidate()
+            self._prefetch_key = key
+        if not model:
+            return
+        start = self.engine.ok_count + 1
+        self.label_prefetcher.prefetch(
+            [self.engine.serial_no_for(n) for n in range(start, start + self.label_prefetcher.depth)],
+            model, vendor, full=self._needs_print_canvas(),
+        )
+
     def on_combo_model_changed(self, text: str):
-        """Hiển thị model đang chọn từ comboBox lên show_model."""
+        """Hiển thị model đang chọn từ comboBox lên show_model (và cập nhật model cho engine)."""
+        self.engine.set_model(text)
+        self.prefetch_labels()
         if hasattr(self, "show_model") and self.show_model is not None:
             self.show_model.setText(text or "")
 
@@ -803,8 +3640,63 @@ class MyWindow(QMainWindow):
 
 
 # ================== MAIN ==================
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="FT Assy Charger Base")
+    parser.add_argument("--bench", choices=["framer", "engine", "label", "qr", "log", "sensors"],
+                        help="chạy micro-benchmark rồi thoát (không mở GUI)")
+    parser.add_argument("--normalize-data", nargs="?", const="", metavar="DIR",
+                        help="chuẩn hoá mọi file kết quả trong data/ (bỏ cột rỗng thừa) rồi thoát")
+    parser.add_argument("--db-import", action="store_true",
+                        help="nạp các file data/adc_data_*.csv vào data/results.db")
+    parser.add_argument("--find-sn", metavar="SN", help="tra cứu 1 S/N trong data/results.db")
+    parser.add_argument("--db-export", metavar="CSV", help="xuất data/results.db ra CSV")
+    parser.add_argument("--date-from", metavar="YYYY-MM-DD", help="lọc theo ngày (từ)")
+    parser.add_argument("--date-to", metavar="YYYY-MM-DD", help="lọc theo ngày (đến)")
+    parser.add_argument("--batch-labels", metavar="OUT",
+                        help="in lại hàng loạt label OK ra file PDF nhiều trang hoặc 'print' (backend trong config.csv)")
+    parser.add_argument("--sn-from", metavar="SN", help="--batch-labels: S/N đầu (bao gồm)")
+    parser.add_argument("--sn-to", metavar="SN", help="--batch-labels: S/N cuối (bao gồm)")
+    parser.add_argument("--batch-model", metavar="MODEL", help="--batch-labels: model cho dòng CSV không lưu model")
+    parser.add_argument("--workers", type=int, help="--batch-labels: số process mã hoá QR (mặc định = số core)")
+    parser.add_argument("--replay", metavar="LOG",
+                        help="chạy headless: đưa các dòng trong file log qua StationEngine rồi thoát")
+    # Các tham số còn lại (vd. -platform offscreen) được chuyển cho Qt
+    return parser.parse_known_args(argv)
+
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    multiprocessing.freeze_support()  # process con của --batch-labels khi đóng gói PyInstaller
+    args, qt_argv = parse_args(sys.argv[1:])
+    if args.bench == "framer":
+        bench_line_framer()
+        bench_line_framer(chunk_size=64)
+        sys.exit(0)
+    if args.bench == "engine":
+        bench_engine()
+        sys.exit(0)
+    if args.bench == "label":
+        bench_label_render()
+        sys.exit(0)
+    if args.bench == "qr":
+        bench_qr_image()
+        sys.exit(0)
+    if args.bench == "log":
+        bench_log_console()
+        sys.exit(0)
+    if args.bench == "sensors":
+        bench_sensor_widgets()
+        sys.exit(0)
+    if args.replay:
+        run_replay(args.replay)
+        sys.exit(0)
+    if args.batch_labels:
+        sys.exit(run_batch_labels(os.path.join(app_dir(), "data"), args))
+    if args.db_import or args.find_sn or args.db_export:
+        sys.exit(run_result_db(os.path.join(app_dir(), "data"), args))
+    if args.normalize_data is not None:
+        sys.exit(run_normalize(args.normalize_data or os.path.join(app_dir(), "data")))
+
+    app = QApplication(sys.argv[:1] + qt_argv)
     window = MyWindow()
     window.show()
     sys.exit(app.exec_())